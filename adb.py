@@ -0,0 +1,52 @@
+# Awaitable wrappers around db.py / modules/* for use inside handlers.
+# Every call runs on the db thread pool (db.run_db), so the event loop never blocks on SQLite.
+# The sync functions stay importable from db / modules for scripts.
+import db
+from db import aio
+from modules import ads, language, leaderboard, lottery, ref_tasks, stats, vip
+
+# db
+get_or_create_user = aio(db.get_or_create_user)
+get_user = aio(db.get_user)
+get_user_cached = aio(db.get_user_cached)
+user_ids_page = aio(db.user_ids_page)
+set_lang = aio(db.set_lang)
+add_tickets = aio(db.add_tickets)
+add_donation = aio(db.add_donation)
+apply_credits = aio(db.apply_credits)
+ref_counts = aio(db.ref_counts)
+flush_profiles = aio(db.flush_profiles)
+
+# leaderboards (served from memory; the pool only matters when a board has to rebuild)
+top_tickets = aio(leaderboard.top_tickets)
+top_donors = aio(leaderboard.top_donors)
+check_leaderboards = aio(leaderboard.check_drift)
+
+# language
+apply_lang_choice = aio(language.apply_lang_choice)
+
+# vip
+is_vip = aio(vip.is_vip)
+vip_until_ts = aio(vip.vip_until_ts)
+activate_vip = aio(vip.activate_vip)
+expire_vips = aio(vip.expire_due)
+
+# lottery
+get_current_cycle = aio(lottery.get_current_cycle)
+join_lottery = aio(lottery.join_lottery)
+close_cycle_and_start_new = aio(lottery.close_cycle_and_start_new)
+
+# ads
+create_order = aio(ads.create_order)
+set_status = aio(ads.set_status)
+review_page = aio(ads.review_page)
+review_ads = aio(ads.review)
+
+# referral tasks
+get_active_tasks = aio(ref_tasks.get_active_tasks)
+add_ref_task = aio(ref_tasks.add_ref_task)
+deactivate_task = aio(ref_tasks.deactivate_task)
+complete_task = aio(ref_tasks.complete_task)
+
+# stats
+stats_text = aio(stats.stats_text)
@@ -0,0 +1,133 @@
+# Cluster throughput: the same stream of raw updates (a /start, menu and /lottery_join mix
+# over many users) pushed through modules.cluster with 1, 2, 4 ... workers, each a full bot
+# process against one seeded SQLite file and a fake Bot API. Checks that every update was
+# handled and that ticket totals add up afterwards.
+#
+#   python bench/cluster_scaling.py --users 5000 --updates 20000 --workers 1,2,4
+#   python bench/cluster_scaling.py --api-ms 20     # Bot API round trip per call
+#
+# Throughput only scales with free cores; compare against `nproc`.
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:bench")
+# setdefault: the spawned workers re-run this module and must see the parent's file
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bench_cluster_"), "bench.sqlite3"))
+os.environ["OUTBOX_GLOBAL_PER_SEC"] = "1000000"
+os.environ["OUTBOX_PER_CHAT_SEC"] = "0"
+os.environ["FLOOD_ENABLED"] = "0"
+os.environ.setdefault("BENCH_API_MS", "0")
+
+from telegram.ext import ExtBot  # noqa: E402
+
+import db  # noqa: E402
+from locales import LANGS  # noqa: E402
+from modules.cluster import Cluster  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+START_TICKETS = 1000
+
+
+class FakeBot(ExtBot):
+    async def _do_post(self, endpoint, data, **kwargs):
+        if endpoint == "getMe":
+            return BOT_USER
+        delay = float(os.environ["BENCH_API_MS"]) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+        if endpoint in ("sendMessage", "editMessageText"):
+            return {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id") or 1), "type": "private"},
+                "from": BOT_USER,
+                "text": data.get("text", ""),
+            }
+        return True
+
+
+def make_bot():
+    return FakeBot(os.environ["BOT_TOKEN"])
+
+
+def seed(users: int):
+    with db.get_db() as conn:
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM lottery_entries")
+        conn.executemany(
+            "INSERT INTO users(user_id, username, first_name, lang, tickets, created_at) VALUES (?,?,?,?,?,?)",
+            [(uid, f"u{uid}", "Bench", "ua", START_TICKETS, 0) for uid in range(1, users + 1)],
+        )
+
+
+def make_updates(users: int, count: int, rng: random.Random) -> list:
+    balance = LANGS["ua"]["balance"]
+    out = []
+    for i in range(1, count + 1):
+        uid = rng.randint(1, users)
+        text = rng.choice(("/start", balance, "/lottery_join 1"))
+        msg = {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": "Bench", "username": f"u{uid}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        out.append({"update_id": i, "message": msg})
+    return out
+
+
+def check_tickets(users: int) -> tuple[int, int]:
+    # every ticket a user lost sits in a lottery entry
+    with db.get_db() as conn:
+        held = conn.execute("SELECT COALESCE(SUM(tickets), 0) FROM users").fetchone()[0]
+        entered = conn.execute("SELECT COALESCE(SUM(tickets), 0) FROM lottery_entries").fetchone()[0]
+    return held + entered, users * START_TICKETS
+
+
+async def run(workers: int, updates: list) -> tuple[float, int]:
+    cluster = Cluster(workers, bot_factory=make_bot)
+    await cluster.start()
+    t0 = time.perf_counter()
+    for data in updates:
+        await cluster.dispatch(data)
+    handled = await cluster.stop(timeout=600)
+    return time.perf_counter() - t0, handled
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--updates", type=int, default=10000)
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--api-ms", type=float, default=0.0, help="simulated Bot API latency per call")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    os.environ["BENCH_API_MS"] = str(args.api_ms)
+
+    db.init_db()
+    updates = make_updates(args.users, args.updates, random.Random(args.seed))
+    print(f"{os.cpu_count()} CPUs, {args.updates} updates over {args.users} users, api {args.api_ms:g} ms")
+    base = None
+    for n in (int(x) for x in args.workers.split(",")):
+        seed(args.users)
+        elapsed, handled = asyncio.run(run(n, updates))
+        rate = handled / elapsed
+        base = base or rate
+        total, expected = check_tickets(args.users)
+        print(f"workers {n:>2}: {handled}/{len(updates)} in {elapsed:.2f}s, {rate:.0f} updates/s (x{rate / base:.2f}), tickets {total}/{expected}")
+        assert handled == len(updates), "updates lost"
+        assert total == expected, "ticket totals don't add up"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
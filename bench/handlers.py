@@ -0,0 +1,279 @@
+# Handler benchmark: drives the real handlers (registered by main.register_handlers) with
+# synthetic updates against a fake Bot and a seeded SQLite DB.
+#
+#   python bench/handlers.py --users 100000 --iterations 2000
+#   python bench/handlers.py --users 1000 --save bench/baseline.json
+#   python bench/handlers.py --users 1000 --compare bench/baseline.json
+#   python bench/handlers.py --users 1000 --metrics --compare bench/baseline.json
+#
+# Per scenario: throughput, p50/p99 latency, SQL statements, connections opened and
+# Bot API calls per update. The trace callback used to count statements adds a little
+# overhead of its own, so compare runs with each other, not with production numbers.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_handlers_"), "bench.sqlite3")
+os.environ["ADMIN_IDS"] = "1"  # exercise admin notifications in the ads flow
+os.environ["OUTBOX_GLOBAL_PER_SEC"] = "1000000"
+os.environ["OUTBOX_PER_CHAT_SEC"] = "0"
+os.environ.setdefault("FLOOD_ENABLED", "0")  # scenarios replay far faster than any real user
+if "--metrics" in sys.argv:
+    os.environ["METRICS_ENABLED"] = "1"  # read by config at import
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, ExtBot  # noqa: E402
+
+import db  # noqa: E402
+
+# ---------------- instrumentation ----------------
+counts = Counter()
+_counts_lock = threading.Lock()
+_orig_connect = db._connect
+
+
+def _on_sql(_stmt):
+    with _counts_lock:
+        counts["sql"] += 1
+
+
+def _counting_connect():
+    conn = _orig_connect()
+    with _counts_lock:
+        counts["connections"] += 1
+    conn.set_trace_callback(_on_sql)
+    return conn
+
+
+db._connect = _counting_connect
+
+import main as bot  # noqa: E402
+from locales import LANGS  # noqa: E402
+from modules import leaderboard  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+class FakeBot(ExtBot):
+    # answers every Bot API call locally and records the endpoint
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._calls = Counter()
+        self._msg_id = 0
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        self._calls[endpoint] += 1
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "editMessageText"):
+            self._msg_id += 1
+            return {
+                "message_id": self._msg_id,
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id") or 1), "type": "private"},
+                "from": BOT_USER,
+                "text": data.get("text", ""),
+            }
+        return True
+
+
+# ---------------- seeding ----------------
+def seed(users: int, rng: random.Random):
+    db.init_db()
+    langs = list(LANGS)
+    with db.get_db() as conn:
+        cycle_id = conn.execute("SELECT id FROM lottery_cycles WHERE closed=0").fetchone()[0]
+        for start in range(1, users + 1, 50_000):
+            batch = range(start, min(users, start + 49_999) + 1)
+            conn.executemany(
+                "INSERT INTO users(user_id, username, first_name, lang, tickets, created_at) VALUES (?,?,?,?,?,?)",
+                [(uid, f"u{uid}", "Bench", rng.choice(langs), rng.randint(100, 1000), 0) for uid in batch],
+            )
+            conn.executemany(
+                "INSERT INTO lottery_entries(cycle_id, user_id, tickets) VALUES (?,?,?)",
+                [(cycle_id, uid, rng.randint(1, 50)) for uid in batch if rng.random() < 0.3],
+            )
+    leaderboard.rebuild()
+
+
+# ---------------- synthetic updates ----------------
+class Updates:
+    def __init__(self, bot, users: int, rng: random.Random):
+        self.bot = bot
+        self.users = users
+        self.rng = rng
+        self.update_id = 0
+        self.new_uid = users + 1
+
+    def _user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": "Bench", "username": f"u{uid}"}
+
+    def _wrap(self, payload):
+        self.update_id += 1
+        return Update.de_json(dict(payload, update_id=self.update_id), self.bot)
+
+    def message(self, uid, text):
+        msg = {
+            "message_id": self.update_id + 1,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._wrap({"message": msg})
+
+    def callback(self, uid, data):
+        return self._wrap({
+            "callback_query": {
+                "id": str(self.update_id + 1),
+                "from": self._user(uid),
+                "chat_instance": str(uid),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": uid, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                },
+            }
+        })
+
+    def uid(self):
+        return self.rng.randint(1, self.users)
+
+
+def label(action):
+    return LANGS["ua"][action]
+
+
+# scenario -> list of updates per operation (an operation may need several, e.g. the ads flow)
+SCENARIOS = {
+    "start": lambda u: [u.message(u.uid(), "/start")],
+    "start_new_user": lambda u: [u.message(next_new(u), f"/start {u.uid()}")],
+    "menu_balance": lambda u: [u.message(u.uid(), label("balance"))],
+    "menu_lottery": lambda u: [u.message(u.uid(), label("lottery"))],
+    "lottery_join": lambda u: [u.message(u.uid(), "/lottery_join 1")],
+    "cb_language": lambda u: [u.callback(u.uid(), f"lang:{u.rng.choice(list(LANGS))}")],
+    "ads_order_flow": lambda u: (lambda uid: [
+        u.message(uid, label("ads")),
+        u.callback(uid, "ads:buy"),
+        u.message(uid, "Bench ad | https://example.com"),
+    ])(u.uid()),
+}
+
+
+def next_new(u):
+    u.new_uid += 1
+    return u.new_uid
+
+
+def pct(sorted_vals, p):
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    seed(args.users, rng)
+    print(f"seeded {args.users} users in {time.perf_counter() - t0:.1f}s")
+
+    fake = FakeBot(os.environ["BOT_TOKEN"])
+    app = ApplicationBuilder().bot(fake).updater(None).build()
+    bot.register_handlers(app)
+    bot.metrics.instrument_handlers(app)
+    await app.initialize()
+    bot.outbox.start(app.bot)
+
+    updates = Updates(fake, args.users, rng)
+    only = set(args.only.split(",")) if args.only else None
+    results = {}
+    try:
+        for name, make in SCENARIOS.items():
+            if only and name not in only:
+                continue
+            for _ in range(args.warmup):
+                for upd in make(updates):
+                    await app.process_update(upd)
+            ops = [make(updates) for _ in range(args.iterations)]
+
+            counts.clear()
+            fake._calls.clear()
+            lat = []
+            start = time.perf_counter()
+            for batch in ops:
+                t = time.perf_counter()
+                for upd in batch:
+                    await app.process_update(upd)
+                lat.append(time.perf_counter() - t)
+            elapsed = time.perf_counter() - start
+
+            lat.sort()
+            n = len(ops)
+            results[name] = {
+                "ops_per_sec": round(n / elapsed, 1),
+                "p50_ms": round(pct(lat, 0.50) * 1000, 3),
+                "p99_ms": round(pct(lat, 0.99) * 1000, 3),
+                "sql_per_op": round(counts["sql"] / n, 2),
+                "connections_per_op": round(counts["connections"] / n, 3),
+                "bot_calls_per_op": round(sum(fake._calls.values()) / n, 2),
+            }
+    finally:
+        await bot.outbox.stop()
+        await app.shutdown()
+        await bot.adb.flush_profiles()
+        bot.close_pool()
+    return results
+
+
+def report(results, baseline=None):
+    cols = ("ops_per_sec", "p50_ms", "p99_ms", "sql_per_op", "connections_per_op", "bot_calls_per_op")
+    print(f"{'scenario':<16}" + "".join(f"{c:>20}" for c in cols))
+    for name, r in results.items():
+        row = f"{name:<16}"
+        for c in cols:
+            cell = f"{r[c]:g}"
+            old = (baseline or {}).get(name, {}).get(c)
+            if old:
+                cell += f" ({(r[c] - old) / old * 100:+.0f}%)"
+            row += f"{cell:>20}"
+        print(row)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=10_000, help="seeded users (10^3 .. 10^6)")
+    ap.add_argument("--iterations", type=int, default=1000, help="operations per scenario")
+    ap.add_argument("--warmup", type=int, default=50)
+    ap.add_argument("--only", default="", help="comma-separated scenario names")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--save", help="write results as a JSON baseline")
+    ap.add_argument("--compare", help="JSON baseline to diff against")
+    ap.add_argument("--metrics", action="store_true", help="run with METRICS_ENABLED=1 (overhead check)")
+    args = ap.parse_args()
+
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"users": args.users, "iterations": args.iterations, "results": results}, f, indent=2)
+        print(f"baseline saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Lottery draw benchmark: streaming weighted draw vs the old per-ticket list expansion.
+#
+#   python bench/lottery_draw.py                 # 10^3 .. 10^7 tickets
+#   python bench/lottery_draw.py --max-exp 6 --winners 5
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_lottery_"), "bench.sqlite3")
+
+import db  # noqa: E402
+from modules import lottery  # noqa: E402
+
+
+def legacy_pick_winner(cycle_id: int):
+    # modules.lottery.pick_winner before the streaming engine
+    with db.get_db() as conn:
+        rows = conn.execute(
+            "SELECT user_id, tickets FROM lottery_entries WHERE cycle_id=?",
+            (cycle_id,),
+        ).fetchall()
+    pool = []
+    for r in rows:
+        pool.extend([int(r["user_id"])] * int(r["tickets"]))
+    if not pool:
+        return None
+    return random.choice(pool)
+
+
+def seed_cycle(cycle_id: int, total_tickets: int, rng: random.Random) -> int:
+    # mostly small holders plus a few VIPs with the 250-ticket bonus
+    rows = []
+    uid = 0
+    left = total_tickets
+    while left > 0:
+        uid += 1
+        n = 250 + rng.randint(0, 50) if rng.random() < 0.1 else rng.randint(1, 30)
+        n = min(n, left)
+        rows.append((cycle_id, uid, n))
+        left -= n
+    with db.get_db() as conn:
+        conn.executemany("INSERT INTO lottery_entries(cycle_id, user_id, tickets) VALUES (?,?,?)", rows)
+    return len(rows)
+
+
+def measure(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--min-exp", type=int, default=3)
+    ap.add_argument("--max-exp", type=int, default=7)
+    ap.add_argument("--winners", type=int, default=1, help="k for the streaming engine")
+    args = ap.parse_args()
+
+    db.init_db()
+    rng = random.Random(42)
+
+    print(f"{'tickets':>10} {'entries':>8} | {'legacy s':>9} {'legacy MiB':>10} | {'stream s':>9} {'stream MiB':>10} | speedup")
+    for exp in range(args.min_exp, args.max_exp + 1):
+        cycle_id = 1000 + exp
+        entries = seed_cycle(cycle_id, 10 ** exp, rng)
+
+        lt, lm = measure(legacy_pick_winner, cycle_id)
+        st, sm = measure(lottery.draw, cycle_id, args.winners)
+
+        print(
+            f"{10 ** exp:>10} {entries:>8} | {lt:>9.4f} {lm / 2**20:>10.2f} | "
+            f"{st:>9.4f} {sm / 2**20:>10.2f} | {lt / st if st else 0:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Concurrency check for modules.lottery.join_lottery: many parallel joins against a real
+# SQLite file must never overspend a balance and must conserve tickets.
+#
+#   python bench/lottery_join_stress.py --users 50 --joins 5000 --workers 16
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_join_"), "bench.sqlite3")
+
+import db  # noqa: E402
+from modules import lottery  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--tickets", type=int, default=100, help="starting balance per user")
+    ap.add_argument("--joins", type=int, default=5000)
+    ap.add_argument("--workers", type=int, default=16)
+    args = ap.parse_args()
+
+    db.init_db()
+    with db.get_db() as conn:
+        conn.executemany(
+            "INSERT INTO users(user_id, tickets) VALUES (?,?)",
+            [(uid, args.tickets) for uid in range(1, args.users + 1)],
+        )
+    cycle_id = lottery.get_current_cycle()["id"]
+    total_before = args.users * args.tickets
+
+    rng = random.Random(7)
+    calls = [(rng.randint(1, args.users), rng.randint(1, 5)) for _ in range(args.joins)]
+
+    def run(call):
+        uid, n = call
+        return n, lottery.join_lottery(cycle_id, uid, n)
+
+    # pool threads keep persistent connections, like the bot's db pool
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.workers, initializer=db._init_worker) as pool:
+        results = list(pool.map(run, calls))
+    elapsed = time.perf_counter() - t0
+
+    ok = [n for n, r in results if r]
+    with db.get_db() as conn:
+        balances = conn.execute("SELECT COALESCE(SUM(tickets), 0), MIN(tickets) FROM users").fetchone()
+        entered = conn.execute(
+            "SELECT COALESCE(SUM(tickets), 0) FROM lottery_entries WHERE cycle_id=?", (cycle_id,)
+        ).fetchone()[0]
+
+    print(f"joins: {len(calls)} ({len(ok)} accepted, {len(calls) - len(ok)} refused) in {elapsed:.2f}s "
+          f"-> {len(calls) / elapsed:.0f}/s")
+    print(f"tickets: before {total_before}, balances {balances[0]} + entries {entered} = {balances[0] + entered}")
+    assert balances[1] >= 0, "negative balance"
+    assert entered == sum(ok), "entries don't match accepted joins"
+    assert balances[0] + entered == total_before, "tickets not conserved"
+    print("OK: no overspend, tickets conserved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Ordering check for modules.concurrency.KeyedUpdateProcessor: interleaved updates of many
+# users go through a real Application whose handler sleeps a random few ms (a stand-in for
+# Bot API / DB waits). Every user's updates must be handled in arrival order and one at a
+# time, while different users overlap up to the concurrency limit.
+#
+#   python bench/update_order_stress.py --users 200 --per-user 50 --concurrency 32
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:bench")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, ExtBot, TypeHandler  # noqa: E402
+
+from modules.concurrency import KeyedUpdateProcessor, job_slot  # noqa: E402
+import modules.concurrency as concurrency  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+class FakeBot(ExtBot):
+    async def _do_post(self, endpoint, data, **kwargs):
+        return BOT_USER if endpoint == "getMe" else True
+
+
+def make_updates(bot, users: int, per_user: int, rng: random.Random):
+    # per-user sequence numbers, users interleaved at random
+    order = [uid for uid in range(1, users + 1) for _ in range(per_user)]
+    rng.shuffle(order)
+    seq = defaultdict(int)
+    updates = []
+    for i, uid in enumerate(order, 1):
+        seq[uid] += 1
+        updates.append(Update.de_json({
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+                "text": str(seq[uid]),
+            },
+        }, bot))
+    return updates
+
+
+async def run(args, concurrency: int):
+    rng = random.Random(args.seed)
+    seen = defaultdict(list)
+    active = defaultdict(int)
+    stats = {"running": 0, "peak": 0, "overlap_same_user": 0}
+
+    async def handler(update, context):
+        uid = update.effective_user.id
+        active[uid] += 1
+        stats["running"] += 1
+        stats["peak"] = max(stats["peak"], stats["running"])
+        if active[uid] > 1:
+            stats["overlap_same_user"] += 1
+        try:
+            await asyncio.sleep(rng.uniform(0, args.max_sleep_ms) / 1000)
+            seen[uid].append(int(update.message.text))
+        finally:
+            active[uid] -= 1
+            stats["running"] -= 1
+
+    bot = FakeBot(os.environ["BOT_TOKEN"])
+    app = (
+        ApplicationBuilder()
+        .bot(bot)
+        .updater(None)
+        .concurrent_updates(KeyedUpdateProcessor(concurrency, backlog=args.backlog))
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, handler))
+    updates = make_updates(bot, args.users, args.per_user, rng)
+
+    await app.initialize()
+    await app.start()
+    t0 = time.perf_counter()
+    for upd in updates:
+        await app.update_queue.put(upd)
+    await app.update_queue.join()
+    while app.update_processor.backlog():
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - t0
+    await app.stop()
+    await app.shutdown()
+
+    reordered = sum(1 for uid, got in seen.items() if got != sorted(got))
+    handled = sum(len(v) for v in seen.values())
+    return elapsed, handled, reordered, stats
+
+
+async def run_jobs(n: int):
+    # job_slot budget: n jobs started at once, at most JOB_CONCURRENCY run together
+    state = {"running": 0, "peak": 0}
+
+    @job_slot
+    async def job():
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.005)
+        state["running"] -= 1
+
+    await asyncio.gather(*(job() for _ in range(n)))
+    return state["peak"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--per-user", type=int, default=50)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--backlog", type=int, default=4096)
+    ap.add_argument("--max-sleep-ms", type=float, default=5.0)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    total = args.users * args.per_user
+    for c in (1, args.concurrency):
+        elapsed, handled, reordered, stats = asyncio.run(run(args, c))
+        print(
+            f"concurrency {c:>3}: {handled}/{total} updates in {elapsed:.2f}s ({handled / elapsed:.0f}/s), "
+            f"peak running {stats['peak']}, users reordered {reordered}, "
+            f"same-user overlaps {stats['overlap_same_user']}"
+        )
+        assert handled == total, "updates lost"
+        assert reordered == 0, "per-user order violated"
+        assert stats["overlap_same_user"] == 0, "two updates of one user ran at once"
+        assert stats["peak"] <= c, "concurrency limit exceeded"
+
+    peak = asyncio.run(run_jobs(50))
+    print(f"jobs: 50 started at once, peak running {peak} (JOB_CONCURRENCY={concurrency.JOB_CONCURRENCY})")
+    assert peak <= concurrency.JOB_CONCURRENCY
+    print("OK: per-user order kept, limits respected")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,42 @@ def _must(name: str) -> str:
 
 BOT_TOKEN = _must("BOT_TOKEN")
 
+# Update delivery: "polling" (default) or "webhook".
+# Webhook with an empty WEBHOOK_URL only starts the local listener (no setWebhook) -
+# handy for POSTing recorded Update JSON with curl.
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")                  # public base URL, e.g. https://bot.up.railway.app
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")            # X-Telegram-Bot-Api-Secret-Token; required with WEBHOOK_URL
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
 # Admins: "123,456"
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()]
 
 # DB
 DB_PATH = os.getenv("DB_PATH", "bot.sqlite3")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))                   # worker threads, 1 connection each
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")                # OFF / NORMAL / FULL
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))        # page cache per connection
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# User snapshot cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))         # rows kept (LRU)
+USER_CACHE_TTL_SEC = int(os.getenv("USER_CACHE_TTL_SEC", "60"))
+
+# Profile (username / first_name) write-behind
+PROFILE_FLUSH_MS = int(os.getenv("PROFILE_FLUSH_MS", "2000"))
+PROFILE_FLUSH_ROWS = int(os.getenv("PROFILE_FLUSH_ROWS", "200"))
 
 # VIP
 VIP_PRICE_STARS = int(os.getenv("VIP_PRICE_STARS", "50"))         # 50 ⭐
 VIP_TICKETS_BONUS = int(os.getenv("VIP_TICKETS_BONUS", "250"))    # +250 tickets
 VIP_MULTIPLIER = float(os.getenv("VIP_MULTIPLIER", "2.0"))        # x2
 VIP_DAYS_DEFAULT = int(os.getenv("VIP_DAYS_DEFAULT", "30"))       # 30 days
+VIP_SWEEP_SEC = int(os.getenv("VIP_SWEEP_SEC", "300"))            # expiry check + "VIP expired" notices
 
 # Referrals (%)
 REF_LVL1_PCT = float(os.getenv("REF_LVL1_PCT", "0.10"))
@@ -28,10 +53,58 @@ REF_LVL3_PCT = float(os.getenv("REF_LVL3_PCT", "0.02"))
 # Lottery
 LOTTERY_PERIOD_HOURS = int(os.getenv("LOTTERY_PERIOD_HOURS", "168"))  # 7 days
 LOTTERY_PRIZE_TEXT = os.getenv("LOTTERY_PRIZE_TEXT", "🎁 Prize")
+LOTTERY_WINNERS = int(os.getenv("LOTTERY_WINNERS", "1"))              # distinct winners per cycle
+LOTTERY_DRAW_CHUNK = int(os.getenv("LOTTERY_DRAW_CHUNK", "1000"))      # entries fetched per round trip
+
+# Leaderboards (in-memory top lists)
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "50"))             # deepest top needed (rewards: top 50)
+LEADERBOARD_CHECK_MIN = int(os.getenv("LEADERBOARD_CHECK_MIN", "30"))   # SQL drift check interval
 
 # Ads autopost
 ADS_AUTOPOST_EVERY_MIN = int(os.getenv("ADS_AUTOPOST_EVERY_MIN", "180"))
 ADS_CHANNEL_ID = os.getenv("ADS_CHANNEL_ID", "")  # e.g. "-1001234567890" (channel id). If empty: disabled.
+# Several channels with their own slots: "-1001=09:00,15:00,21:00;-1002=*/120"
+# (HH:MM = server local time, */N = every N minutes). Overrides ADS_CHANNEL_ID when set.
+ADS_CHANNELS = os.getenv("ADS_CHANNELS", "")
+ADS_PREFETCH_WINDOW_MIN = int(os.getenv("ADS_PREFETCH_WINDOW_MIN", "60"))  # claim ads for the slots in this window
+ADS_MAX_ATTEMPTS = int(os.getenv("ADS_MAX_ATTEMPTS", "3"))                # then status=failed
+ADS_REVIEW_PAGE_SIZE = int(os.getenv("ADS_REVIEW_PAGE_SIZE", "5"))        # orders per /moderate page
+
+# Outgoing messages (Telegram: ~30 msg/s per bot, ~1 msg/s per chat)
+OUTBOX_GLOBAL_PER_SEC = float(os.getenv("OUTBOX_GLOBAL_PER_SEC", "25"))
+OUTBOX_PER_CHAT_SEC = float(os.getenv("OUTBOX_PER_CHAT_SEC", "1.0"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_QUEUE_SIZE = int(os.getenv("OUTBOX_QUEUE_SIZE", "1000"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+
+# Update processing: handlers of different users run concurrently, one user's updates in order
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))   # handlers running at once
+UPDATE_BACKLOG = int(os.getenv("UPDATE_BACKLOG", "4096"))         # update tasks incl. those waiting for their user
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))          # JobQueue callbacks running at once
+
+# Cluster mode: one ingest process + N worker processes, updates partitioned by user id.
+# 0 or 1 = everything in one process.
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0"))
+CLUSTER_QUEUE_SIZE = int(os.getenv("CLUSTER_QUEUE_SIZE", "10000"))   # updates buffered per worker
+CLUSTER_JOB_WORKER = int(os.getenv("CLUSTER_JOB_WORKER", "0"))       # worker that runs lottery / ads jobs
+
+# PTB persistence (user_data / chat_data / bot_data in SQLite): changed keys are written every N seconds
+PERSISTENCE_FLUSH_SEC = float(os.getenv("PERSISTENCE_FLUSH_SEC", "10"))
+
+# Flood control (in memory, before any handler): "kind=tokens_per_sec:burst" for command / callback / text
+FLOOD_ENABLED = os.getenv("FLOOD_ENABLED", "1") == "1"
+FLOOD_USER = os.getenv("FLOOD_USER", "command=1:5,callback=2:10,text=1:5")
+FLOOD_CHAT = os.getenv("FLOOD_CHAT", "command=3:15,callback=6:30,text=3:15")
+FLOOD_MAX_KEYS = int(os.getenv("FLOOD_MAX_KEYS", "100000"))   # buckets kept in memory (LRU beyond that)
+FLOOD_IDLE_SEC = int(os.getenv("FLOOD_IDLE_SEC", "600"))      # idle buckets are dropped
+
+# Metrics: handler/job latency, SQL timing, Prometheus text on http://METRICS_LISTEN:METRICS_PORT/metrics
+# Off by default; when off nothing is wrapped or traced.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))            # log statements slower than this
 
 # Payment links for UAH/USD (external provider)
 PAYMENT_UAH_URL = os.getenv("PAYMENT_UAH_URL", "")
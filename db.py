@@ -1,86 +1,410 @@
+import asyncio
+import functools
+import logging
 import sqlite3
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from config import DB_PATH
+from modules import metrics
+from config import (
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_SYNCHRONOUS,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_BUSY_TIMEOUT_MS,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL_SEC,
+    PROFILE_FLUSH_MS,
+    PROFILE_FLUSH_ROWS,
+    REF_LVL1_PCT,
+    REF_LVL2_PCT,
+    REF_LVL3_PCT,
+)
+
+log = logging.getLogger("db")
+
+_local = threading.local()
+_pool = None
+_pool_closed = False  # set by close_pool(); background flushes then stop instead of reopening it
+_pool_conns = []
+_pool_lock = threading.Lock()
 
 def _connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        factory=metrics.connection_factory(),
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
     return conn
 
 @contextmanager
 def get_db():
-    conn = _connect()
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # sync callers (scripts, init): short-lived connection
+        conn = _connect()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+        return
+
+    # pool worker: persistent connection, commit only at the outermost block
+    _local.depth += 1
     try:
         yield conn
-        conn.commit()
+        if _local.depth == 1:
+            conn.commit()
+    except BaseException:
+        if _local.depth == 1:
+            conn.rollback()
+        raise
     finally:
-        conn.close()
+        _local.depth -= 1
+
+# Cluster mode (modules/cluster.py): worker processes share one cross-process lock for
+# write transactions, so they queue in order instead of polling SQLite's busy handler.
+_write_lock = None
+
+def set_write_lock(lock):
+    global _write_lock
+    _write_lock = lock
+
+@contextmanager
+def transaction():
+    # get_db() that takes the write lock up front (BEGIN IMMEDIATE): read-then-write
+    # sequences inside it can't interleave with another writer
+    with get_db() as db:
+        if db.in_transaction:
+            yield db
+            return
+        lock = _write_lock
+        if lock is None:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            return
+        # a worker killed mid-transaction never releases the lock: past the busy timeout,
+        # fall back to SQLite's own locking
+        locked = lock.acquire(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                db.commit()  # before handing the lock on
+            except BaseException:
+                db.rollback()
+                raise
+        finally:
+            if locked:
+                lock.release()
+
+# ---------------- async access (thread pool) ----------------
+def _init_worker():
+    _local.conn = _connect()
+    _local.depth = 0
+    with _pool_lock:
+        _pool_conns.append(_local.conn)
+
+def _get_pool():
+    global _pool, _pool_closed
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=DB_POOL_SIZE,
+                    thread_name_prefix="db",
+                    initializer=_init_worker,
+                )
+                _pool_closed = False
+    return _pool
+
+async def run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), functools.partial(fn, *args, **kwargs))
+
+def aio(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+    return wrapper
+
+def close_pool():
+    global _pool, _pool_closed
+    if _pool is None:
+        return
+    _pool_closed = True
+    _pool.shutdown(wait=True)
+    _pool = None
+    with _pool_lock:
+        for conn in _pool_conns:
+            conn.close()
+        _pool_conns.clear()
+
+# ---------------- schema migrations ----------------
+# PRAGMA user_version = number of applied steps. Steps are append-only and idempotent
+# (a pre-versioning DB already has some of these objects), each runs in its own transaction.
+def _m001_base_tables(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        lang TEXT DEFAULT 'ua',
+        tickets INTEGER DEFAULT 0,
+        vip_until INTEGER DEFAULT 0,
+        donated_total REAL DEFAULT 0,
+        donated_xtr INTEGER DEFAULT 0,
+        donated_uah REAL DEFAULT 0,
+        donated_usd REAL DEFAULT 0,
+        created_at INTEGER DEFAULT 0
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS refs (
+        user_id INTEGER PRIMARY KEY,
+        ref1 INTEGER,
+        ref2 INTEGER,
+        ref3 INTEGER
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS lottery_entries (
+        cycle_id INTEGER,
+        user_id INTEGER,
+        tickets INTEGER,
+        PRIMARY KEY (cycle_id, user_id)
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS lottery_cycles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ends_at INTEGER,
+        started_at INTEGER,
+        winner_id INTEGER DEFAULT NULL,
+        closed INTEGER DEFAULT 0
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS ads_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        text TEXT,
+        link TEXT,
+        price REAL,
+        currency TEXT,
+        status TEXT, -- pending_payment / pending_review / approved / rejected / posting / posted / failed
+        created_at INTEGER
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS donations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount REAL,
+        currency TEXT,
+        ts INTEGER
+    )
+    """)
+
+def _m002_lottery_draw_audit(db):
+    if not _has_column(db, "lottery_cycles", "draw_seed"):
+        db.execute("ALTER TABLE lottery_cycles ADD COLUMN draw_seed INTEGER DEFAULT NULL")
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS lottery_winners (
+        cycle_id INTEGER,
+        place INTEGER,
+        user_id INTEGER,
+        PRIMARY KEY (cycle_id, place)
+    )
+    """)
+
+def _m003_hot_query_indexes(db):
+    # leaderboards / rewards: ORDER BY tickets DESC, ORDER BY donated_total DESC (covering)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_tickets ON users(tickets DESC, user_id)")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_donated ON users("
+        "donated_total DESC, user_id, donated_xtr, donated_uah, donated_usd)"
+    )
+    # ads queue: WHERE status=? ORDER BY created_at (id as tie-breaker / keyset)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ads_orders_status ON ads_orders(status, created_at, id)")
+    # per-user donation history
+    db.execute("CREATE INDEX IF NOT EXISTS idx_donations_user ON donations(user_id, ts)")
+
+def _m004_referral_tasks(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS referral_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        link TEXT,
+        reward_stars INTEGER DEFAULT 1,
+        active INTEGER DEFAULT 1
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS referral_task_logs (
+        user_id INTEGER,
+        task_id INTEGER,
+        completed INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, task_id)
+    )
+    """)
+
+def _m005_single_open_cycle(db):
+    # at most one open lottery cycle, enforced by SQLite
+    db.execute("""
+    UPDATE lottery_cycles SET closed=1
+    WHERE closed=0 AND id < (SELECT MAX(id) FROM lottery_cycles WHERE closed=0)
+    """)
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_lottery_cycles_open ON lottery_cycles(closed) WHERE closed=0")
+
+def _m006_ads_delivery(db):
+    for col, ddl in (
+        ("channel_id", "TEXT"),
+        ("attempts", "INTEGER DEFAULT 0"),
+        ("claimed_at", "INTEGER"),
+        ("posted_at", "INTEGER"),
+        ("last_error", "TEXT"),
+    ):
+        if not _has_column(db, "ads_orders", col):
+            db.execute(f"ALTER TABLE ads_orders ADD COLUMN {col} {ddl}")
+
+def _m007_ledger_reason(db):
+    # why a credit was made: donation / lottery_reward / ref_task / ...
+    if not _has_column(db, "donations", "reason"):
+        db.execute("ALTER TABLE donations ADD COLUMN reason TEXT")
+
+def _m008_rollups(db):
+    # revenue per UTC day x currency; per user x month (donor counts); tickets per day x reason
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS donation_daily (
+        day TEXT,
+        currency TEXT,
+        amount REAL DEFAULT 0,
+        n INTEGER DEFAULT 0,
+        PRIMARY KEY (day, currency)
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS donation_user_month (
+        user_id INTEGER,
+        month TEXT,
+        amount REAL DEFAULT 0,
+        n INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, month)
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS donation_month (
+        month TEXT PRIMARY KEY,
+        donors INTEGER DEFAULT 0
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS ticket_daily (
+        day TEXT,
+        reason TEXT,
+        issued INTEGER DEFAULT 0,
+        spent INTEGER DEFAULT 0,
+        PRIMARY KEY (day, reason)
+    )
+    """)
+    backfill_rollups(db)
+
+def _m009_referral_counts(db):
+    # downline sizes per level, maintained at signup (refs stores each user's full ancestor chain)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS ref_counts (
+        user_id INTEGER PRIMARY KEY,
+        lvl1 INTEGER DEFAULT 0,
+        lvl2 INTEGER DEFAULT 0,
+        lvl3 INTEGER DEFAULT 0
+    )
+    """)
+    db.execute("DELETE FROM ref_counts")
+    db.execute("""
+    INSERT INTO ref_counts(user_id, lvl1, lvl2, lvl3)
+    SELECT a, SUM(l = 1), SUM(l = 2), SUM(l = 3) FROM (
+        SELECT ref1 AS a, 1 AS l FROM refs WHERE ref1 IS NOT NULL
+        UNION ALL SELECT ref2, 2 FROM refs WHERE ref2 IS NOT NULL
+        UNION ALL SELECT ref3, 3 FROM refs WHERE ref3 IS NOT NULL
+    ) GROUP BY a
+    """)
+
+def _m010_ptb_persistence(db):
+    # modules/persistence.py: pickled user_data / chat_data / bot_data / conversations
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS ptb_data (
+        kind TEXT,
+        key TEXT,
+        data BLOB,
+        PRIMARY KEY (kind, key)
+    )
+    """)
+
+def _m011_vip_expiry(db):
+    # modules/vip.py: vip_notified = the vip_until whose expiry was already announced;
+    # the partial index holds exactly the VIPs still to load / sweep
+    if not _has_column(db, "users", "vip_notified"):
+        db.execute("ALTER TABLE users ADD COLUMN vip_notified INTEGER DEFAULT 0")
+    db.execute("UPDATE users SET vip_notified=vip_until WHERE vip_until>0 AND vip_until<=?", (int(time.time()),))
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_vip_pending ON users(vip_until) WHERE vip_until > vip_notified")
+
+def _m012_donation_only_rollups(db):
+    # the rollups used to count reward payouts as revenue / donors
+    backfill_rollups(db)
+
+MIGRATIONS = [
+    _m001_base_tables,
+    _m002_lottery_draw_audit,
+    _m003_hot_query_indexes,
+    _m004_referral_tasks,
+    _m005_single_open_cycle,
+    _m006_ads_delivery,
+    _m007_ledger_reason,
+    _m008_rollups,
+    _m009_referral_counts,
+    _m010_ptb_persistence,
+    _m011_vip_expiry,
+    _m012_donation_only_rollups,
+]
+
+def _has_column(db, table: str, column: str) -> bool:
+    return any(r["name"] == column for r in db.execute(f"PRAGMA table_info({table})"))
+
+def schema_version(db) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(db) -> int:
+    if schema_version(db) >= len(MIGRATIONS):
+        return 0
+    applied = 0
+    for version, step in enumerate(MIGRATIONS, 1):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # re-check under the write lock: another process may have migrated meanwhile
+            if schema_version(db) < version:
+                step(db)
+                db.execute(f"PRAGMA user_version={version}")
+                applied += 1
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    return applied
 
 def init_db():
     with get_db() as db:
-        db.execute("PRAGMA journal_mode=WAL;")
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            lang TEXT DEFAULT 'ua',
-            tickets INTEGER DEFAULT 0,
-            vip_until INTEGER DEFAULT 0,
-            donated_total REAL DEFAULT 0,
-            donated_xtr INTEGER DEFAULT 0,
-            donated_uah REAL DEFAULT 0,
-            donated_usd REAL DEFAULT 0,
-            created_at INTEGER DEFAULT 0
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS refs (
-            user_id INTEGER PRIMARY KEY,
-            ref1 INTEGER,
-            ref2 INTEGER,
-            ref3 INTEGER
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS lottery_entries (
-            cycle_id INTEGER,
-            user_id INTEGER,
-            tickets INTEGER,
-            PRIMARY KEY (cycle_id, user_id)
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS lottery_cycles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ends_at INTEGER,
-            started_at INTEGER,
-            winner_id INTEGER DEFAULT NULL,
-            closed INTEGER DEFAULT 0
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS ads_orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            text TEXT,
-            link TEXT,
-            price REAL,
-            currency TEXT,
-            status TEXT, -- pending_payment / pending_review / approved / rejected / posted
-            created_at INTEGER
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS donations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount REAL,
-            currency TEXT,
-            ts INTEGER
-        )
-        """)
+        migrate(db)
 
         now = int(time.time())
         # create first lottery cycle if none
@@ -91,33 +415,221 @@ def init_db():
                 (now + 7 * 86400, now),
             )
 
-def get_or_create_user(user_id: int, username: str | None, first_name: str | None):
+def get_or_create_user(user_id: int, username: str | None, first_name: str | None, ref_id: int | None = None):
+    # ref_id (from /start <ref_id>) is only recorded when this call creates the user
+    u = get_user_cached(user_id)
+    if u:
+        # keep profile fresh, but only write real changes and write them in batches
+        if queue_profile_update(user_id, username, first_name, (u.get("username"), u.get("first_name"))):
+            u = dict(u, username=username, first_name=first_name)
+        return u
+
     now = int(time.time())
-    with get_db() as db:
-        u = db.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
-        if u:
-            # keep profile fresh
-            db.execute("UPDATE users SET username=?, first_name=? WHERE user_id=?", (username, first_name, user_id))
-            return dict(u)
-        db.execute(
-            "INSERT INTO users(user_id, username, first_name, created_at) VALUES (?,?,?,?)",
+    with transaction() as db:
+        cur = db.execute(
+            "INSERT OR IGNORE INTO users(user_id, username, first_name, created_at) VALUES (?,?,?,?)",
             (user_id, username, first_name, now),
         )
-        return dict(db.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone())
+        if cur.rowcount and ref_id and ref_id != user_id:
+            write_referral(db, user_id, ref_id)
+        u = dict(db.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone())
+    invalidate_user(user_id)
+    return u
 
 def set_lang(user_id: int, lang: str):
-    with get_db() as db:
+    with transaction() as db:
         db.execute("UPDATE users SET lang=? WHERE user_id=?", (lang, user_id))
+    invalidate_user(user_id)
 
-def add_tickets(user_id: int, amount: int):
-    with get_db() as db:
-        db.execute("UPDATE users SET tickets=tickets+? WHERE user_id=?", (amount, user_id))
+def add_tickets(user_id: int, amount: int, reason: str = "bonus"):
+    with transaction() as db:
+        r = db.execute(
+            "UPDATE users SET tickets=tickets+? WHERE user_id=? RETURNING tickets",
+            (amount, user_id),
+        ).fetchone()
+        if r:
+            count_tickets(db, reason, issued=amount)
+            notify_user_value(user_id, "tickets", r[0])
+    invalidate_user(user_id)
 
 def get_user(user_id: int):
     with get_db() as db:
         u = db.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
         return dict(u) if u else None
 
+def user_ids_page(after_id: int = 0, limit: int = 500):
+    # keyset page over the PK: cost doesn't grow with the offset
+    with get_db() as db:
+        rows = db.execute(
+            "SELECT user_id FROM users WHERE user_id>? ORDER BY user_id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [int(r[0]) for r in rows]
+
+# ---------------- user snapshot cache (LRU + TTL) ----------------
+# Rows returned from here are shared snapshots: read them, don't mutate them.
+# Writers call invalidate_user() after their commit.
+_user_cache = OrderedDict()  # user_id -> (expires_at, row)
+_user_cache_lock = threading.Lock()
+_user_cache_gen = 0
+_user_cache_hits = 0
+_user_cache_misses = 0
+
+def get_user_cached(user_id: int):
+    global _user_cache_hits, _user_cache_misses
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry and entry[0] > now:
+            _user_cache.move_to_end(user_id)
+            _user_cache_hits += 1
+            return entry[1]
+        _user_cache_misses += 1
+        gen = _user_cache_gen
+
+    u = get_user(user_id)
+    if u is None:
+        return None
+
+    with _user_cache_lock:
+        # a write landed while we were reading -> don't cache a possibly stale row
+        if gen == _user_cache_gen:
+            _user_cache[user_id] = (now + USER_CACHE_TTL_SEC, u)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
+    return u
+
+def invalidate_user(user_id: int):
+    global _user_cache_gen
+    with _user_cache_lock:
+        _user_cache_gen += 1
+        _user_cache.pop(user_id, None)
+
+def user_cache_stats():
+    with _user_cache_lock:
+        total = _user_cache_hits + _user_cache_misses
+        return {
+            "size": len(_user_cache),
+            "hits": _user_cache_hits,
+            "misses": _user_cache_misses,
+            "hit_rate": (_user_cache_hits / total) if total else 0.0,
+        }
+
+# ---------------- value listeners ----------------
+# Called with (user_id, column, new_value) for users.tickets / users.donated_total changes.
+# Writers notify inside their transaction, i.e. while holding the SQLite write lock,
+# so listeners see the changes of one user in commit order.
+_value_listeners = []
+
+def on_user_value(fn):
+    _value_listeners.append(fn)
+    return fn
+
+def notify_user_value(user_id: int, column: str, value):
+    for fn in _value_listeners:
+        fn(user_id, column, value)
+
+# ---------------- write-behind profile refresh ----------------
+# username / first_name changes are buffered and written in one transaction
+# every PROFILE_FLUSH_MS or as soon as PROFILE_FLUSH_ROWS changes are pending.
+_profile_pending = {}  # user_id -> (username, first_name)
+_profile_lock = threading.Lock()
+_profile_timer = None
+
+def queue_profile_update(user_id: int, username: str | None, first_name: str | None, stored: tuple) -> bool:
+    # stored = (username, first_name) as currently in the row; returns False if nothing changed
+    global _profile_timer
+    flush_now = False
+    with _profile_lock:
+        if _profile_pending.get(user_id, stored) == (username, first_name):
+            return False
+        _profile_pending[user_id] = (username, first_name)
+        if len(_profile_pending) >= PROFILE_FLUSH_ROWS:
+            flush_now = True
+        else:
+            _arm_profile_timer()
+    if flush_now:
+        # only an early flush: a failure must not fail the caller's update
+        _flush_profiles_logged()
+    return True
+
+def _arm_profile_timer():
+    # under _profile_lock
+    global _profile_timer
+    if _profile_timer is None and _profile_pending:
+        _profile_timer = threading.Timer(PROFILE_FLUSH_MS / 1000, _flush_profiles_later)
+        _profile_timer.daemon = True
+        _profile_timer.start()
+
+def _flush_profiles_logged():
+    try:
+        flush_profiles()
+    except Exception as e:
+        _profile_flush_failed(e)
+
+def _profile_flush_failed(exc):
+    log.error("profile flush failed, retrying in %d ms", PROFILE_FLUSH_MS, exc_info=exc)
+    # flush_profiles() put the batch back; try again later
+    with _profile_lock:
+        _arm_profile_timer()
+
+def _flush_profiles_later():
+    # timer thread -> hand the write to a pool worker (persistent connection)
+    global _profile_timer
+    pool = _pool
+    if pool is None and not _pool_closed:
+        # sync/script use: no pool was ever started, write from here
+        _flush_profiles_logged()
+        return
+    try:
+        if pool is None:
+            raise RuntimeError("pool closed")
+        fut = pool.submit(flush_profiles)
+    except RuntimeError:
+        # after close_pool(): shutdown already flushed, don't start a new pool for stragglers
+        with _profile_lock:
+            if _profile_timer is threading.current_thread():
+                _profile_timer = None
+            if _profile_pending:
+                log.warning("profile flush: pool closed, %d updates dropped", len(_profile_pending))
+                _profile_pending.clear()
+        return
+    fut.add_done_callback(_profile_flush_done)
+
+def _profile_flush_done(fut):
+    exc = fut.exception()
+    if exc is not None:
+        _profile_flush_failed(exc)
+
+def flush_profiles() -> int:
+    global _profile_timer
+    with _profile_lock:
+        if _profile_timer is not None:
+            _profile_timer.cancel()
+            _profile_timer = None
+        batch = dict(_profile_pending)
+        _profile_pending.clear()
+    if not batch:
+        return 0
+
+    try:
+        with transaction() as db:
+            db.executemany(
+                "UPDATE users SET username=?, first_name=? WHERE user_id=?",
+                [(un, fn, uid) for uid, (un, fn) in batch.items()],
+            )
+    except Exception:
+        # put the batch back unless a newer value arrived meanwhile
+        with _profile_lock:
+            for uid, prof in batch.items():
+                _profile_pending.setdefault(uid, prof)
+        raise
+
+    for uid in batch:
+        invalidate_user(uid)
+    return len(batch)
+
 def top_tickets(limit: int = 5):
     with get_db() as db:
         rows = db.execute(
@@ -126,17 +638,181 @@ def top_tickets(limit: int = 5):
         ).fetchall()
         return [dict(r) for r in rows]
 
-def add_donation(user_id: int, amount: float, currency: str):
-    import time
+# ---------------- rollups ----------------
+# Kept in the same transaction as the ledger writes, so /stats never has to scan `donations`.
+def utc_day(ts: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+def _write_rollups(db, ts: int, money, tickets):
+    day, month = utc_day(ts), utc_day(ts)[:7]
+    # revenue / donors: donations only, not payouts (lottery_reward, ref_task, ...)
+    money = [c for c in money if c[3] == "donation"]
+    if money:
+        per_cur, per_user = {}, {}
+        for uid, amount, cur, _ in money:
+            a, n = per_cur.get(cur, (0, 0))
+            per_cur[cur] = (a + amount, n + 1)
+            a, n = per_user.get(uid, (0, 0))
+            per_user[uid] = (a + amount, n + 1)
+        db.executemany(
+            "INSERT INTO donation_daily(day, currency, amount, n) VALUES (?,?,?,?) "
+            "ON CONFLICT(day, currency) DO UPDATE SET amount=amount+excluded.amount, n=n+excluded.n",
+            [(day, cur, a, n) for cur, (a, n) in per_cur.items()],
+        )
+        # first donation of the month for a user -> one more donor that month
+        db.executemany(
+            "INSERT INTO donation_month(month, donors) "
+            "SELECT ?, 1 WHERE NOT EXISTS (SELECT 1 FROM donation_user_month WHERE user_id=? AND month=?) "
+            "ON CONFLICT(month) DO UPDATE SET donors=donors+1",
+            [(month, uid, month) for uid in per_user],
+        )
+        db.executemany(
+            "INSERT INTO donation_user_month(user_id, month, amount, n) VALUES (?,?,?,?) "
+            "ON CONFLICT(user_id, month) DO UPDATE SET amount=amount+excluded.amount, n=n+excluded.n",
+            [(uid, month, a, n) for uid, (a, n) in per_user.items()],
+        )
+    if tickets:
+        per_reason = {}
+        for uid, amount, _, reason in tickets:
+            per_reason[reason] = per_reason.get(reason, 0) + int(amount)
+        for reason, issued in per_reason.items():
+            count_tickets(db, reason, issued=issued, ts=ts)
+
+def count_tickets(db, reason: str, issued: int = 0, spent: int = 0, ts: int | None = None):
+    db.execute(
+        "INSERT INTO ticket_daily(day, reason, issued, spent) VALUES (?,?,?,?) "
+        "ON CONFLICT(day, reason) DO UPDATE SET issued=issued+excluded.issued, spent=spent+excluded.spent",
+        (utc_day(ts or int(time.time())), reason or "bonus", issued, spent),
+    )
+
+def backfill_rollups(db):
+    # rebuilds the donation rollups from `donations` (tickets have no history to rebuild from);
+    # rows from before the reason column (NULL) were all donations
+    db.execute("DELETE FROM donation_daily")
+    db.execute("DELETE FROM donation_user_month")
+    db.execute("DELETE FROM donation_month")
+    db.execute("""
+    INSERT INTO donation_daily(day, currency, amount, n)
+    SELECT date(ts, 'unixepoch'), currency, SUM(amount), COUNT(*) FROM donations
+    WHERE COALESCE(reason, 'donation')='donation' GROUP BY 1, 2
+    """)
+    db.execute("""
+    INSERT INTO donation_user_month(user_id, month, amount, n)
+    SELECT user_id, strftime('%Y-%m', ts, 'unixepoch'), SUM(amount), COUNT(*) FROM donations
+    WHERE COALESCE(reason, 'donation')='donation' GROUP BY 1, 2
+    """)
+    db.execute("""
+    INSERT INTO donation_month(month, donors)
+    SELECT month, COUNT(*) FROM donation_user_month GROUP BY month
+    """)
+
+# ---------------- ledger ----------------
+# A credit is (user_id, amount, currency, reason). XTR / UAH / USD credits are written to
+# `donations` and added to the users.donated_* aggregates; TICKETS credits go to users.tickets.
+# A batch is applied with executemany in one transaction (one commit / fsync).
+TICKETS = "TICKETS"
+DONATED_COLUMNS = {"XTR": "donated_xtr", "UAH": "donated_uah", "USD": "donated_usd"}
+
+def write_credits(db, credits) -> set:
+    # inside the caller's transaction; returns the user ids to invalidate after commit
     ts = int(time.time())
+    money = [c for c in credits if c[2] != TICKETS]
+    tickets = [(int(amount), uid) for uid, amount, cur, _ in credits if cur == TICKETS]
+    if money:
+        db.executemany(
+            "INSERT INTO donations(user_id, amount, currency, ts, reason) VALUES (?,?,?,?,?)",
+            [(uid, amount, cur, ts, reason) for uid, amount, cur, reason in money],
+        )
+        for cur, col in DONATED_COLUMNS.items():
+            rows = [
+                (int(amount) if cur == "XTR" else amount, amount, uid)
+                for uid, amount, c, _ in money if c == cur
+            ]
+            if rows:
+                db.executemany(
+                    f"UPDATE users SET {col}={col}+?, donated_total=donated_total+? WHERE user_id=?",
+                    rows,
+                )
+    if tickets:
+        db.executemany("UPDATE users SET tickets=tickets+? WHERE user_id=?", tickets)
+    _write_rollups(db, ts, money, [c for c in credits if c[2] == TICKETS])
+
+    uids = {c[0] for c in credits}
+    if _value_listeners:
+        ticket_ids = {uid for _, uid in tickets}
+        money_ids = {c[0] for c in money if c[2] in DONATED_COLUMNS}
+        ids = list(uids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for r in db.execute(
+                f"SELECT user_id, tickets, donated_total FROM users WHERE user_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                if r["user_id"] in ticket_ids:
+                    notify_user_value(r["user_id"], "tickets", r["tickets"])
+                if r["user_id"] in money_ids:
+                    notify_user_value(r["user_id"], "donated_total", r["donated_total"])
+    return uids
+
+def apply_credits(credits) -> int:
+    credits = list(credits)
+    if not credits:
+        return 0
+    with transaction() as db:
+        uids = write_credits(db, credits)
+    for uid in uids:
+        invalidate_user(uid)
+    return len(credits)
+
+def add_donation(user_id: int, amount: float, currency: str, reason: str = "donation"):
+    with transaction() as db:
+        credits = [(user_id, amount, currency, reason)]
+        if reason == "donation":
+            credits += referral_credits(db, user_id, amount)
+        uids = write_credits(db, credits)
+    for uid in uids:
+        invalidate_user(uid)
+
+# ---------------- referrals ----------------
+# refs holds every user's ancestor chain (ref1 = inviter, ref2 = inviter's inviter, ref3),
+# copied from the inviter's row at signup; ref_counts holds downline sizes per level.
+# Neither is ever recomputed by walking the tree.
+REF_LEVELS = ((1, REF_LVL1_PCT), (2, REF_LVL2_PCT), (3, REF_LVL3_PCT))
+
+def write_referral(db, user_id: int, ref_id: int) -> bool:
+    row = db.execute(
+        "INSERT OR IGNORE INTO refs(user_id, ref1, ref2, ref3) "
+        "SELECT ?, u.user_id, r.ref1, r.ref2 FROM users u LEFT JOIN refs r ON r.user_id=u.user_id "
+        "WHERE u.user_id=? RETURNING ref1, ref2, ref3",
+        (user_id, ref_id),
+    ).fetchone()
+    if not row:
+        return False  # unknown inviter
+    for level, ancestor in enumerate(row, 1):
+        if ancestor is not None:
+            db.execute(
+                f"INSERT INTO ref_counts(user_id, lvl{level}) VALUES (?, 1) "
+                f"ON CONFLICT(user_id) DO UPDATE SET lvl{level}=lvl{level}+1",
+                (ancestor,),
+            )
+    return True
+
+def referral_credits(db, user_id: int, amount: float) -> list:
+    # ticket credits for the donor's ancestors, to be written in the donor's transaction
+    row = db.execute("SELECT ref1, ref2, ref3 FROM refs WHERE user_id=?", (user_id,)).fetchone()
+    if not row:
+        return []
+    credits = []
+    for (level, pct), ancestor in zip(REF_LEVELS, row):
+        reward = int(amount * pct)
+        if ancestor is not None and reward > 0:
+            credits.append((ancestor, reward, TICKETS, f"ref_l{level}"))
+    return credits
+
+def ref_counts(user_id: int) -> tuple:
     with get_db() as db:
-        db.execute("INSERT INTO donations(user_id, amount, currency, ts) VALUES (?,?,?,?)", (user_id, amount, currency, ts))
-        if currency == "XTR":
-            db.execute("UPDATE users SET donated_xtr=donated_xtr+?, donated_total=donated_total+? WHERE user_id=?", (int(amount), amount, user_id))
-        elif currency == "UAH":
-            db.execute("UPDATE users SET donated_uah=donated_uah+?, donated_total=donated_total+? WHERE user_id=?", (amount, amount, user_id))
-        elif currency == "USD":
-            db.execute("UPDATE users SET donated_usd=donated_usd+?, donated_total=donated_total+? WHERE user_id=?", (amount, amount, user_id))
+        r = db.execute("SELECT lvl1, lvl2, lvl3 FROM ref_counts WHERE user_id=?", (user_id,)).fetchone()
+        return tuple(r) if r else (0, 0, 0)
 
 def top_donors(limit: int = 5):
     with get_db() as db:
@@ -146,21 +822,3 @@ def top_donors(limit: int = 5):
             (limit,),
         ).fetchall()
         return [dict(r) for r in rows]
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS referral_tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            link TEXT,
-            reward_stars INTEGER DEFAULT 1,
-            active INTEGER DEFAULT 1
-        )
-        """)
-
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS referral_task_logs (
-            user_id INTEGER,
-            task_id INTEGER,
-            completed INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, task_id)
-        )
-        """)
@@ -15,12 +15,20 @@ LANGS = {
         "vip_buy": "👑 Купити VIP",
         "vip_active": "✅ VIP активний",
         "vip_inactive": "—",
+        "vip_expired": "⌛ Твій VIP закінчився. Продовж, щоб зберегти множник x2 👇",
         "donate": "💰 Донат",
         "donate_top": "🏆 Топ донатів",
         "lottery_left": "⏳ До кінця",
         "lottery_top": "🏆 Топ по білетах",
         "lottery_join": "➕ Увійти в розіграш",
         "lottery_join_hint": "Використання: /lottery_join 5",
+        "lottery_joined": "✅ У розіграші: {entry} 🎟\nЗалишок: {balance} 🎟",
+        "ref_screen": "👥 Рефералка\n\nТвоє посилання:\n{link}\n\n1 рівень: {l1}\n2 рівень: {l2}\n3 рівень: {l3}\n\nЗа донати твоїх рефералів ти отримуєш білети: {p1}% / {p2}% / {p3}%.",
+        "earn_title": "⭐ Завдання\n\nВиконай завдання і натисни ✅, щоб отримати нагороду:",
+        "earn_empty": "⭐ Зараз завдань немає. Загляни пізніше.",
+        "task_done_btn": "✅ Виконано",
+        "task_done": "✅ Нараховано: +{reward} 🎟 і +{reward} ⭐",
+        "task_already": "Це завдання вже виконане.",
         "need_tickets": "Треба мати білети. Спочатку зароби/отримай білети.",
         "ad_buy": "🧾 Купити рекламу",
         "ad_status": "📌 Статус реклами",
@@ -42,12 +50,20 @@ LANGS = {
         "vip_buy": "👑 Buy VIP",
         "vip_active": "✅ VIP active",
         "vip_inactive": "—",
+        "vip_expired": "⌛ Your VIP has expired. Renew it to keep the x2 multiplier 👇",
         "donate": "💰 Donate",
         "donate_top": "🏆 Top donors",
         "lottery_left": "⏳ Time left",
         "lottery_top": "🏆 Tickets leaderboard",
         "lottery_join": "➕ Join lottery",
         "lottery_join_hint": "Usage: /lottery_join 5",
+        "lottery_joined": "✅ In the draw: {entry} 🎟\nBalance: {balance} 🎟",
+        "ref_screen": "👥 Referrals\n\nYour link:\n{link}\n\nLevel 1: {l1}\nLevel 2: {l2}\nLevel 3: {l3}\n\nYou get tickets for your referrals' donations: {p1}% / {p2}% / {p3}%.",
+        "earn_title": "⭐ Tasks\n\nComplete a task and press ✅ to get the reward:",
+        "earn_empty": "⭐ No tasks right now. Check back later.",
+        "task_done_btn": "✅ Done",
+        "task_done": "✅ Credited: +{reward} 🎟 and +{reward} ⭐",
+        "task_already": "This task is already done.",
         "need_tickets": "You need tickets first.",
         "ad_buy": "🧾 Buy ads",
         "ad_status": "📌 Ads status",
@@ -69,15 +85,31 @@ LANGS = {
         "vip_buy": "👑 Купить VIP",
         "vip_active": "✅ VIP активен",
         "vip_inactive": "—",
+        "vip_expired": "⌛ Твой VIP закончился. Продли, чтобы сохранить множитель x2 👇",
         "donate": "💰 Донат",
         "donate_top": "🏆 Топ донатов",
         "lottery_left": "⏳ До конца",
         "lottery_top": "🏆 Топ по билетам",
         "lottery_join": "➕ Участвовать",
         "lottery_join_hint": "Исп: /lottery_join 5",
+        "lottery_joined": "✅ В розыгрыше: {entry} 🎟\nОстаток: {balance} 🎟",
+        "ref_screen": "👥 Рефералка\n\nТвоя ссылка:\n{link}\n\n1 уровень: {l1}\n2 уровень: {l2}\n3 уровень: {l3}\n\nЗа донаты твоих рефералов ты получаешь билеты: {p1}% / {p2}% / {p3}%.",
+        "earn_title": "⭐ Задания\n\nВыполни задание и нажми ✅, чтобы получить награду:",
+        "earn_empty": "⭐ Сейчас заданий нет. Загляни позже.",
+        "task_done_btn": "✅ Выполнено",
+        "task_done": "✅ Начислено: +{reward} 🎟 и +{reward} ⭐",
+        "task_already": "Это задание уже выполнено.",
         "need_tickets": "Сначала нужны билеты.",
         "ad_buy": "🧾 Купить рекламу",
         "ad_status": "📌 Статус рекламы",
         "back": "⬅️ Назад",
     },
 }
+
+def check_locales():
+    # every language must define every key used by any language
+    keys = set().union(*(strings.keys() for strings in LANGS.values()))
+    missing = {lang: sorted(keys - strings.keys()) for lang, strings in LANGS.items() if keys - strings.keys()}
+    if missing:
+        raise RuntimeError(f"locales: missing keys {missing}")
+    return keys
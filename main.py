@@ -1,7 +1,10 @@
+import asyncio
 import logging
 import time
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -13,18 +16,35 @@ from telegram.ext import (
 
 from config import (
     BOT_TOKEN,
+    BOT_MODE,
+    WEBHOOK_QUEUE_SIZE,
     ADMIN_IDS,
     VIP_PRICE_STARS,
+    VIP_SWEEP_SEC,
     PAYMENT_USD_URL,
-    ADS_AUTOPOST_EVERY_MIN,
-    ADS_CHANNEL_ID,
+    LEADERBOARD_CHECK_MIN,
+    BROADCAST_PAGE_SIZE,
+    ADS_REVIEW_PAGE_SIZE,
+    FLOOD_ENABLED,
+    CLUSTER_WORKERS,
+    METRICS_PORT,
+    REF_LVL1_PCT,
+    REF_LVL2_PCT,
+    REF_LVL3_PCT,
 )
 from locales import LANGS
-from db import init_db, get_or_create_user, get_user, top_tickets
-from modules.language import lang_keyboard, apply_lang_choice
+import adb
+from db import init_db, close_pool, user_cache_stats
+from modules.bundles import bundle
 from modules.vip import is_vip, vip_until_ts
-from modules.lottery import get_current_cycle, time_left_str, join_lottery, close_cycle_and_start_new
-from modules.ads import create_order, set_status, pick_next_approved
+from modules.lottery import time_left_str
+from modules import flood, leaderboard, metrics, vip
+from modules.concurrency import KeyedUpdateProcessor, job_slot
+from modules.outbox import Outbox
+from modules.ads_pipeline import AdsPipeline
+from modules.webhook import run_webhook
+from modules.persistence import SQLitePersistence
+from modules.cluster import run_cluster
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,27 +52,44 @@ logging.basicConfig(
 )
 log = logging.getLogger("bot")
 
+outbox = Outbox()
+ads_pipeline = AdsPipeline(outbox)
+metrics_server = metrics.MetricsServer()
+# set by modules/cluster.py in worker processes; a single process is worker 0 and runs the jobs
+cluster_role = {"index": 0, "jobs": True}
+
 
 def t(lang: str, key: str) -> str:
-    return LANGS.get(lang, LANGS["ua"]).get(key, key)
+    return bundle(lang).strings[key]
 
 
 def is_admin(uid: int) -> bool:
     return uid in ADMIN_IDS
 
 
+async def notify_admins(text: str):
+    # queued, not awaited: delivery / retries / failures are the outbox's job
+    for aid in ADMIN_IDS:
+        await outbox.send(aid, text)
+
+
 def main_menu(lang: str):
-    return ReplyKeyboardMarkup(
-        [
-            [t(lang, "earn")],
-            [t(lang, "ref"), t(lang, "ads")],
-            [t(lang, "lottery")],
-            [t(lang, "balance")],
-            [t(lang, "donate")],
-            [t(lang, "lang"), t(lang, "support")],
-        ],
-        resize_keyboard=True
-    )
+    return bundle(lang).main_menu
+
+
+def menu_text(uid: int, user: dict) -> str:
+    b = bundle(user.get("lang", "ua"))
+    return b.menu_tpl.format(uid=uid, tickets=user.get("tickets", 0), vip=b.vip_status(is_vip(uid, user)))
+
+
+async def load_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> dict:
+    # one users row per update: the context object is shared by every handler
+    # (and sub-handler) that runs for this update
+    snap = getattr(context, "user_snapshot", None)
+    if snap is None:
+        snap = await adb.get_user_cached(update.effective_user.id) or {}
+        context.user_snapshot = snap
+    return snap
 
 
 def fmt_vip_until(until_ts: int) -> str:
@@ -63,35 +100,33 @@ def fmt_vip_until(until_ts: int) -> str:
 
 async def send_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    user = get_user(u.id) or {}
+    user = await load_user(update, context)
     lang = user.get("lang", "ua")
 
-    await update.message.reply_text(
-        f"{t(lang,'menu_title')}\n\n"
-        f"👤 {t(lang,'your_id')}: {u.id}\n"
-        f"🎟 {t(lang,'tickets')}: {user.get('tickets',0)}\n"
-        f"{t(lang,'vip')}: {t(lang,'vip_active') if is_vip(u.id) else t(lang,'vip_inactive')}",
-        reply_markup=main_menu(lang),
-    )
+    await update.message.reply_text(menu_text(u.id, user), reply_markup=main_menu(lang))
 
 
 # ---------------- Commands ----------------
+def parse_ref_id(arg: str) -> int | None:
+    # /start payload -> inviter id; anything that can't be a Telegram user id (SQLite INTEGER) is ignored
+    if not (arg.isascii() and arg.isdecimal()):
+        return None
+    try:
+        ref_id = int(arg)
+    except ValueError:
+        return None
+    return ref_id if 0 < ref_id < 2**63 else None
+
+
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    user = get_or_create_user(u.id, u.username, u.first_name)
+    # /start <refid>: the inviter is recorded only when this creates the user
+    ref_id = parse_ref_id(context.args[0]) if context.args else None
+    user = await adb.get_or_create_user(u.id, u.username, u.first_name, ref_id)
+    context.user_snapshot = user
     lang = user.get("lang", "ua")
 
-    # referral param (якщо потім треба буде) - поки без хаосу
-    # /start <refid>
-    # if context.args: ...
-
-    await update.message.reply_text(
-        f"{t(lang,'menu_title')}\n\n"
-        f"👤 {t(lang,'your_id')}: {u.id}\n"
-        f"🎟 {t(lang,'tickets')}: {user.get('tickets',0)}\n"
-        f"{t(lang,'vip')}: {t(lang,'vip_active') if is_vip(u.id) else t(lang,'vip_inactive')}",
-        reply_markup=main_menu(lang),
-    )
+    await update.message.reply_text(menu_text(u.id, user), reply_markup=main_menu(lang))
 
 
 async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -100,24 +135,26 @@ async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    user = get_user(u.id) or {}
-    lang = user.get("lang", "ua")
-
-    vip_txt = t(lang, "vip_active") if is_vip(u.id) else t(lang, "vip_inactive")
-    until_str = fmt_vip_until(vip_until_ts(u.id))
+    user = await load_user(update, context)
+    b = bundle(user.get("lang", "ua"))
 
     await update.message.reply_text(
-        f"🎟 {t(lang,'tickets')}: {user.get('tickets',0)}\n"
-        f"{t(lang,'vip')}: {vip_txt}\n"
-        f"⏳ VIP until: {until_str}"
+        b.balance_tpl.format(
+            tickets=user.get("tickets", 0),
+            vip=b.vip_status(is_vip(u.id, user)),
+            until=fmt_vip_until(vip_until_ts(u.id, user)),
+        )
     )
 
 
 async def cmd_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    user = get_user(u.id) or {}
-    lang = user.get("lang", "ua")
-    await update.message.reply_text(t(lang, "choose_lang"), reply_markup=lang_keyboard())
+    user = await load_user(update, context)
+    await show_language(update, user.get("lang", "ua"))
+
+
+async def show_language(update: Update, lang: str):
+    b = bundle(lang)
+    await update.message.reply_text(b.t("choose_lang"), reply_markup=b.lang_keyboard)
 
 
 async def cb_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -126,7 +163,7 @@ async def cb_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     uid = q.from_user.id
     _, lang = q.data.split(":", 1)
-    lang = apply_lang_choice(uid, lang)
+    lang = await adb.apply_lang_choice(uid, lang)
 
     await q.edit_message_text("✅ OK")
     await context.bot.send_message(chat_id=uid, text=t(lang, "menu_title"), reply_markup=main_menu(lang))
@@ -134,28 +171,24 @@ async def cb_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ---------------- Lottery ----------------
 async def show_lottery(update: Update, lang: str):
-    cycle = get_current_cycle()
+    cycle = await adb.get_current_cycle()
     left = time_left_str(cycle["ends_at"]) if cycle else "—"
 
-    tops = top_tickets(5)
-    text = (
-        f"🎟 {t(lang,'lottery')}\n\n"
-        f"⏳ {t(lang,'lottery_left')}: {left}\n\n"
-        f"🏆 {t(lang,'lottery_top')}:\n"
-    )
+    tops = await adb.top_tickets(5)
+    b = bundle(lang)
+    parts = [b.lottery_head.format(left=left)]
     if not tops:
-        text += "—\n"
+        parts.append("—\n")
     else:
         for i, row in enumerate(tops, 1):
-            text += f"{i}. ID {row['user_id']} — {row['tickets']} 🎟\n"
-
-    text += f"\n{t(lang,'lottery_join_hint')}"
-    await update.message.reply_text(text)
+            parts.append(b.lottery_row.format(place=i, uid=row["user_id"], tickets=row["tickets"]))
+    parts.append(b.lottery_foot)
+    await update.message.reply_text("".join(parts))
 
 
 async def cmd_lottery_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    user = get_user(u.id) or {}
+    user = await load_user(update, context)
     lang = user.get("lang", "ua")
 
     if not context.args:
@@ -172,21 +205,23 @@ async def cmd_lottery_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(t(lang, "need_tickets"))
         return
 
-    cycle = get_current_cycle()
+    cycle = await adb.get_current_cycle()
     if not cycle:
         await update.message.reply_text("Lottery not ready")
         return
 
     n = max(1, n)
-    join_lottery(cycle["id"], u.id, n)
-    await update.message.reply_text("✅ OK")
+    res = await adb.join_lottery(cycle["id"], u.id, n)
+    if not res:
+        await update.message.reply_text(t(lang, "need_tickets"))
+        return
+    balance, entry = res
+    await update.message.reply_text(t(lang, "lottery_joined").format(entry=entry, balance=balance))
 
 
 # ---------------- VIP (через підтримку) ----------------
 async def vip_menu(update: Update, lang: str):
-    kb = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(f"{t(lang,'vip_buy')} — {VIP_PRICE_STARS} ⭐", callback_data="vip:info")]]
-    )
+    kb = bundle(lang).vip_keyboard
     await update.message.reply_text(
         "👑 VIP\n"
         f"💫 Ціна: {VIP_PRICE_STARS} ⭐\n"
@@ -203,7 +238,7 @@ async def cb_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     uid = q.from_user.id
-    user = get_user(uid) or {}
+    user = await load_user(update, context)
     lang = user.get("lang", "ua")
 
     await q.edit_message_text(
@@ -219,11 +254,8 @@ async def cb_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ---------------- Ads ----------------
 async def ads_menu(update: Update, lang: str):
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton(t(lang, "ad_buy"), callback_data="ads:buy")],
-        [InlineKeyboardButton(t(lang, "ad_status"), callback_data="ads:status")],
-    ])
-    await update.message.reply_text(t(lang, "ads"), reply_markup=kb)
+    b = bundle(lang)
+    await update.message.reply_text(b.t("ads"), reply_markup=b.ads_keyboard)
 
 
 async def cb_ads(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -231,7 +263,7 @@ async def cb_ads(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     uid = q.from_user.id
-    user = get_user(uid) or {}
+    user = await load_user(update, context)
     lang = user.get("lang", "ua")
 
     if q.data == "ads:buy":
@@ -249,46 +281,103 @@ async def cb_ads(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
 
-async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    user = get_user(u.id) or {}
-    lang = user.get("lang", "ua")
-    text = (update.message.text or "").strip()
+# ---------------- Menu routing ----------------
+async def show_donate(update: Update, lang: str):
+    await update.message.reply_text(
+        "💰 Донати приймаються через адміністратора.\n\n"
+        "Напиши в 🆘 Підтримка."
+    )
 
-    # menu routing
-    if text == t(lang, "lang"):
-        await cmd_language(update, context)
-        return
 
-    if text == t(lang, "balance"):
-        await cmd_balance(update, context)
-        return
+async def show_support(update: Update, lang: str):
+    await update.message.reply_text("🆘 Підтримка: напиши @your_support")
 
-    if text == t(lang, "lottery"):
-        await show_lottery(update, lang)
-        return
 
-    if text == t(lang, "ads"):
-        await ads_menu(update, lang)
+async def show_earn(update: Update, lang: str):
+    tasks = await adb.get_active_tasks()
+    if not tasks:
+        await update.message.reply_text(t(lang, "earn_empty"))
         return
+    done = t(lang, "task_done_btn")
+    rows = [
+        [
+            InlineKeyboardButton(f"{task['title']} · +{task['reward_stars']} ⭐", url=task["link"]),
+            InlineKeyboardButton(done, callback_data=f"task:{task['id']}"),
+        ]
+        for task in tasks
+    ]
+    await update.message.reply_text(t(lang, "earn_title"), reply_markup=InlineKeyboardMarkup(rows))
 
-    if text == t(lang, "donate"):
-        await update.message.reply_text(
-            "💰 Донати приймаються через адміністратора.\n\n"
-            "Напиши в 🆘 Підтримка."
+
+async def cb_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    user = await load_user(update, context)
+    lang = user.get("lang", "ua")
+
+    reward = await adb.complete_task(q.from_user.id, int(q.data.split(":", 1)[1]))
+    if reward:
+        await q.answer(t(lang, "task_done").format(reward=reward), show_alert=True)
+    else:
+        await q.answer(t(lang, "task_already"))
+
+
+async def show_ref(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: str):
+    uid = update.effective_user.id
+    l1, l2, l3 = await adb.ref_counts(uid)
+    await update.message.reply_text(
+        t(lang, "ref_screen").format(
+            link=f"https://t.me/{context.bot.username}?start={uid}",
+            l1=l1, l2=l2, l3=l3,
+            p1=f"{REF_LVL1_PCT * 100:g}", p2=f"{REF_LVL2_PCT * 100:g}", p3=f"{REF_LVL3_PCT * 100:g}",
         )
-        return
+    )
 
-    if text == t(lang, "support"):
-        await update.message.reply_text("🆘 Підтримка: напиши @your_support")
-        return
 
-    if text == t(lang, "earn"):
-        await update.message.reply_text("⭐ Тут будуть завдання/оффери (додамо далі).")
-        return
+MENU_ACTIONS = {
+    "lang": lambda update, context, lang: show_language(update, lang),
+    "balance": lambda update, context, lang: cmd_balance(update, context),
+    "lottery": lambda update, context, lang: show_lottery(update, lang),
+    "ads": lambda update, context, lang: ads_menu(update, lang),
+    "donate": lambda update, context, lang: show_donate(update, lang),
+    "support": lambda update, context, lang: show_support(update, lang),
+    "earn": lambda update, context, lang: show_earn(update, lang),
+    "ref": lambda update, context, lang: show_ref(update, context, lang),
+}
+
+
+def build_menu_routes():
+    # button label (any language) -> (action, lang); lang is None when several
+    # languages share the label, then the user's own lang is used
+    routes = {}
+    for lang, strings in LANGS.items():
+        for action in MENU_ACTIONS:
+            label = strings.get(action)
+            if not label:
+                continue
+            if label not in routes:
+                routes[label] = (action, lang)
+                continue
+            prev_action, prev_lang = routes[label]
+            if prev_action != action:
+                raise RuntimeError(f"menu label {label!r} is used for both {prev_action} and {action}")
+            if prev_lang != lang:
+                routes[label] = (action, None)
+    return routes
+
+
+MENU_ROUTES = build_menu_routes()
+
+
+async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    u = update.effective_user
+    text = (update.message.text or "").strip()
 
-    if text == t(lang, "ref"):
-        await update.message.reply_text("👥 Рефералка (додамо далі без зламу).")
+    route = MENU_ROUTES.get(text)
+    if route:
+        action, lang = route
+        if lang is None:
+            lang = (await load_user(update, context)).get("lang", "ua")
+        await MENU_ACTIONS[action](update, context, lang)
         return
 
     # ads flow
@@ -302,10 +391,10 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # pricing example
         price = 10.0
         currency = "USD"
-        order_id = create_order(u.id, ad_text, ad_link, price, currency)
+        order_id = await adb.create_order(u.id, ad_text, ad_link, price, currency)
 
         pay_link = PAYMENT_USD_URL or "Напиши в підтримку для оплати"
-        set_status(order_id, "pending_review")
+        await adb.set_status(order_id, "pending_review")
 
         await update.message.reply_text(
             f"🧾 Order #{order_id}\n"
@@ -314,20 +403,15 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Після оплати — чекай модерацію."
         )
 
-        # notify admins
-        for aid in ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    aid,
-                    f"📣 New ad order #{order_id}\n"
-                    f"User: {u.id}\n"
-                    f"Text: {ad_text}\n"
-                    f"Link: {ad_link}\n"
-                    f"Approve: /ad_approve {order_id}\n"
-                    f"Reject: /ad_reject {order_id}"
-                )
-            except Exception:
-                pass
+        await notify_admins(
+            f"📣 New ad order #{order_id}\n"
+            f"User: {u.id}\n"
+            f"Text: {ad_text}\n"
+            f"Link: {ad_link}\n"
+            f"Approve: /ad_approve {order_id}\n"
+            f"Reject: /ad_reject {order_id}\n"
+            f"Queue: /moderate"
+        )
         return
 
 
@@ -340,8 +424,10 @@ async def ad_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /ad_approve <id>")
         return
     oid = int(context.args[0])
-    set_status(oid, "approved")
-    await update.message.reply_text(f"✅ approved #{oid}")
+    if await adb.review_ads([oid], "approved"):
+        await update.message.reply_text(f"✅ approved #{oid}")
+    else:
+        await update.message.reply_text(f"#{oid} is not waiting for review")
 
 
 async def ad_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -352,48 +438,263 @@ async def ad_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /ad_reject <id>")
         return
     oid = int(context.args[0])
-    set_status(oid, "rejected")
-    await update.message.reply_text(f"❌ rejected #{oid}")
+    if await adb.review_ads([oid], "rejected"):
+        await update.message.reply_text(f"❌ rejected #{oid}")
+    else:
+        await update.message.reply_text(f"#{oid} is not waiting for review")
+
+
+# -------- Ad moderation queue: /moderate --------
+def clip(s: str, limit: int) -> str:
+    # Telegram counts message length in UTF-16 code units
+    if len(s.encode("utf-16-le")) // 2 <= limit:
+        return s
+    out, n = [], 1  # room for the ellipsis
+    for ch in s:
+        n += 2 if ord(ch) > 0xFFFF else 1
+        if n > limit:
+            break
+        out.append(ch)
+    return "".join(out) + "…"
+
+
+def moderation_view(orders: list, page: int, has_next: bool):
+    if not orders:
+        return "🗂 Moderation queue is empty.", None
+    lines = [f"🗂 Moderation · page {page + 1}"]
+    # each order gets an equal share of the message, so a page always fits
+    budget = (MessageLimit.MAX_TEXT_LENGTH - 64) // len(orders) - 1
+    kb = []
+    for o in orders:
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(o["created_at"]))
+        lines.append(clip(
+            f"\n#{o['id']} · user {o['user_id']} · {o['price']:g} {o['currency']} · {created}\n"
+            f"{clip(o['text'], 300)}" + (f"\n🔗 {clip(o['link'], 200)}" if o["link"] else ""),
+            budget,
+        ))
+        kb.append([
+            InlineKeyboardButton(f"✅ #{o['id']}", callback_data=f"mod:a:{page}:{o['id']}"),
+            InlineKeyboardButton(f"❌ #{o['id']}", callback_data=f"mod:r:{page}:{o['id']}"),
+        ])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"mod:p:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"mod:p:{page + 1}"))
+    if nav:
+        kb.append(nav)
+    kb.append([InlineKeyboardButton(f"✅ Approve all on page ({len(orders)})", callback_data=f"mod:all:{page}")])
+    return "\n".join(lines), InlineKeyboardMarkup(kb)
+
+
+async def moderation_page(context: ContextTypes.DEFAULT_TYPE, page: int):
+    # start cursors of the pages seen so far are kept per admin, so any page (back or
+    # forward by one) is a single keyset query
+    cursors = context.user_data.setdefault("mod_pages", [None])
+    page = min(page, len(cursors) - 1)
+    orders, has_next = await adb.review_page(cursors[page], ADS_REVIEW_PAGE_SIZE)
+    if not orders and page > 0:
+        # the queue shrank under this page
+        page = 0
+        orders, has_next = await adb.review_page(None, ADS_REVIEW_PAGE_SIZE)
+    # pages after this one move when it changes
+    del cursors[page + 1:]
+    if has_next:
+        cursors.append((orders[-1]["created_at"], orders[-1]["id"]))
+    # what "approve all" applies to: exactly the orders on screen
+    context.user_data["mod_shown"] = {page: [o["id"] for o in orders]}
+    return moderation_view(orders, page, has_next)
+
+
+async def cmd_moderate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    context.user_data["mod_pages"] = [None]
+    text, kb = await moderation_page(context, 0)
+    await update.message.reply_text(text, reply_markup=kb)
 
 
-# -------- Jobs: lottery autoclose + ads autopost --------
-async def job_lottery_check(context: ContextTypes.DEFAULT_TYPE):
-    cycle = get_current_cycle()
-    if not cycle:
+async def cb_moderate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not is_admin(q.from_user.id):
+        await q.answer()
+        return
+    parts = q.data.split(":")
+    action, page = parts[1], int(parts[2])
+    if action == "p":
+        await q.answer()
+    elif action == "all":
+        ids = context.user_data.get("mod_shown", {}).get(page, [])
+        done = await adb.review_ads(ids, "approved")
+        await q.answer(f"✅ approved {len(done)}")
+    else:
+        oid = int(parts[3])
+        done = await adb.review_ads([oid], "approved" if action == "a" else "rejected")
+        if not done:
+            await q.answer(f"#{oid} was already handled")
+        else:
+            await q.answer(f"✅ approved #{oid}" if action == "a" else f"❌ rejected #{oid}")
+    text, kb = await moderation_page(context, page)
+    try:
+        await q.edit_message_text(text, reply_markup=kb)
+    except BadRequest as e:
+        # same page as before; anything else (too long, bad markup) must not go unnoticed
+        if "not modified" not in str(e):
+            raise
+
+
+async def cmd_task_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    parts = [p.strip() for p in " ".join(context.args).split("|")]
+    if len(parts) != 3 or not parts[0].isdigit():
+        await update.message.reply_text("Usage: /task_add <reward> | <title> | <https://link>")
+        return
+    await adb.add_ref_task(parts[1], parts[2], int(parts[0]))
+    await update.message.reply_text("✅ task added")
+
+
+async def cmd_task_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
         return
+    if not context.args:
+        await update.message.reply_text("Usage: /task_off <id>")
+        return
+    tid = int(context.args[0])
+    ok = await adb.deactivate_task(tid)
+    await update.message.reply_text(f"✅ task #{tid} disabled" if ok else f"task #{tid} not active")
+
+
+async def cmd_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    st = user_cache_stats()
+    await update.message.reply_text(
+        f"👤 user cache: {st['size']} rows\n"
+        f"hits: {st['hits']} (SQLite reads saved)\n"
+        f"misses: {st['misses']}\n"
+        f"hit rate: {st['hit_rate']:.1%}"
+    )
+
 
-    if int(time.time()) >= int(cycle["ends_at"]) and int(cycle["closed"]) == 0:
-        closed_cycle, winner = close_cycle_and_start_new()
-        if not closed_cycle:
+async def user_id_pages(page_size: int = BROADCAST_PAGE_SIZE):
+    after = 0
+    while True:
+        ids = await adb.user_ids_page(after, page_size)
+        if not ids:
             return
+        yield ids
+        after = ids[-1]
 
-        for aid in ADMIN_IDS:
-            try:
-                await context.bot.send_message(aid, f"🎟 Lottery ended. Winner: {winner or 'no one'}")
-            except Exception:
-                pass
+
+async def run_broadcast(admin_id: int, text: str):
+    report = await outbox.broadcast(text, user_id_pages())
+    await outbox.send(admin_id, "📢 Broadcast done\n" + report.text())
+
+
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    if not is_admin(uid):
+        return
+    text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await update.message.reply_text("Usage: /broadcast <text>")
+        return
+    context.application.create_task(run_broadcast(uid, text))
+    await update.message.reply_text("📢 Broadcast started")
 
 
-async def job_ads_autopost(context: ContextTypes.DEFAULT_TYPE):
-    if not ADS_CHANNEL_ID:
+async def cmd_ads_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
         return
+    await update.message.reply_text(ads_pipeline.stats_text())
 
-    ad = pick_next_approved()
-    if not ad:
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
         return
+    await update.message.reply_text(await adb.stats_text())
+
+
+# -------- Jobs: lottery autoclose (ads autopost: modules/ads_pipeline.py) --------
+def arm_lottery_close(job_queue, cycle, delay: float | None = None):
+    # one one-shot job at the open cycle's ends_at (overdue -> fires right away)
+    for job in job_queue.get_jobs_by_name("lottery_close"):
+        job.schedule_removal()
+    if delay is None:
+        delay = max(0, int(cycle["ends_at"]) - int(time.time()))
+    job_queue.run_once(job_lottery_close, when=delay, data=cycle["id"], name="lottery_close")
+
 
-    msg = ad["text"] + (f"\n{ad['link']}" if ad.get("link") else "")
+@job_slot
+@metrics.timed
+async def job_lottery_close(context: ContextTypes.DEFAULT_TYPE):
     try:
-        await context.bot.send_message(chat_id=int(ADS_CHANNEL_ID), text=msg)
-        set_status(ad["id"], "posted")
-    except Exception as e:
-        log.warning(f"ads autopost failed: {e}")
+        closed_cycle, winner = await adb.close_cycle_and_start_new(context.job.data)
+    except Exception:
+        log.exception("lottery close failed, retrying in 60s")
+        arm_lottery_close(context.job_queue, {"id": context.job.data}, delay=60)
+        return
 
+    if closed_cycle:
+        winners = ", ".join(str(w) for w in closed_cycle["winners"]) or "no one"
+        await notify_admins(
+            f"🎟 Lottery #{closed_cycle['id']} ended. Winner: {winners}\n"
+            f"Seed: {closed_cycle['draw_seed']}"
+        )
 
-def main():
-    init_db()
+    cycle = await adb.get_current_cycle()
+    if cycle and not cycle["closed"]:
+        arm_lottery_close(context.job_queue, cycle)
+
+
+@job_slot
+@metrics.timed
+async def job_leaderboard_check(context: ContextTypes.DEFAULT_TYPE):
+    await adb.check_leaderboards()
+
+
+@job_slot
+@metrics.timed
+async def job_vip_expiry(context: ContextTypes.DEFAULT_TYPE):
+    expired = await adb.expire_vips()
+    for uid, lang in expired:
+        b = bundle(lang)
+        await outbox.send(uid, b.t("vip_expired"), reply_markup=b.vip_keyboard)
+    if expired:
+        log.info("vip: %d expired", len(expired))
+
+
+async def on_startup(app):
+    outbox.start(app.bot)
+    if metrics.ENABLED:
+        await metrics_server.start(port=METRICS_PORT + cluster_role["index"])
+    if not cluster_role["jobs"]:
+        return
+    # recovers an overdue cycle too: its job fires as soon as the job queue starts
+    cycle = await adb.get_current_cycle()
+    if cycle and not cycle["closed"]:
+        arm_lottery_close(app.job_queue, cycle)
+    await ads_pipeline.start(app.job_queue)
+    app.job_queue.run_repeating(job_vip_expiry, interval=VIP_SWEEP_SEC, first=10)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+
+async def on_stop(app):
+    # the bot is still usable here; after stop() its HTTP client is closed
+    await outbox.stop()
+    await metrics_server.stop()
+
+
+async def on_shutdown(app):
+    # write-behind buffers first, then the pool they flush through
+    await adb.flush_profiles()
+    close_pool()
+
+
+def register_handlers(app):
+    if FLOOD_ENABLED:
+        # decides before the persistence refresh, so a dropped update costs no SQLite read
+        app.add_handler(flood.FloodGuard(), group=-1)
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("menu", cmd_menu))
@@ -401,19 +702,66 @@ def main():
     app.add_handler(CommandHandler("lottery_join", cmd_lottery_join))
     app.add_handler(CommandHandler("ad_approve", ad_approve))
     app.add_handler(CommandHandler("ad_reject", ad_reject))
+    app.add_handler(CommandHandler("moderate", cmd_moderate))
+    app.add_handler(CommandHandler("cache_stats", cmd_cache_stats))
+    app.add_handler(CommandHandler("broadcast", cmd_broadcast))
+    app.add_handler(CommandHandler("ads_stats", cmd_ads_stats))
+    app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("task_add", cmd_task_add))
+    app.add_handler(CommandHandler("task_off", cmd_task_off))
 
     app.add_handler(CallbackQueryHandler(cb_language, pattern=r"^lang:"))
     app.add_handler(CallbackQueryHandler(cb_vip, pattern=r"^vip:"))
     app.add_handler(CallbackQueryHandler(cb_ads, pattern=r"^ads:"))
+    app.add_handler(CallbackQueryHandler(cb_task, pattern=r"^task:\d+$"))
+    app.add_handler(CallbackQueryHandler(cb_moderate, pattern=r"^mod:(p|all):\d+$|^mod:[ar]:\d+:\d+$"))
 
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
 
-    app.job_queue.run_repeating(job_lottery_check, interval=60, first=10)
-    app.job_queue.run_repeating(job_ads_autopost, interval=ADS_AUTOPOST_EVERY_MIN * 60, first=30)
 
+def build_application(bot=None, update_queue=None):
+    builder = ApplicationBuilder()
+    builder = builder.bot(bot) if bot is not None else builder.token(BOT_TOKEN)
+    if update_queue is not None:
+        # no Updater: the webhook listener or the cluster ingest process feeds this queue
+        builder = builder.updater(None).update_queue(update_queue)
+    app = (
+        builder
+        .persistence(SQLitePersistence())
+        .concurrent_updates(KeyedUpdateProcessor())
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    register_handlers(app)
+    if metrics.ENABLED:
+        metrics.instrument_handlers(app)
+        metrics.register_gauge("bot_outbox_messages_total", "Outbox results", lambda: vars(outbox.stats), "counter", "result")
+        metrics.register_gauge("bot_user_cache", "User snapshot cache", user_cache_stats, label="stat")
+        metrics.register_gauge("bot_vip_tracked", "In-memory VIP map / expiry heap", vip.stats, label="stat")
+        metrics.register_gauge("bot_flood_dropped_total", "Updates dropped by flood control", lambda: dict(flood.limiter.dropped), "counter", "kind")
+    # local cache upkeep: every worker runs it for its own boards
+    app.job_queue.run_repeating(job_leaderboard_check, interval=LEADERBOARD_CHECK_MIN * 60, first=LEADERBOARD_CHECK_MIN * 60)
+    return app
+
+
+def main():
+    init_db()
+    if CLUSTER_WORKERS > 1:
+        run_cluster(CLUSTER_WORKERS)
+        return
+
+    leaderboard.rebuild()
+    vip.load()
+    if BOT_MODE == "webhook":
+        # bounded, so a backed-up app fills the webhook's ingest queue and it answers 503
+        run_webhook(build_application(update_queue=asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)))
+        return
+
+    app = build_application()
     app.run_polling(allowed_updates=None)
 
 
 if __name__ == "__main__":
     main()
-
@@ -1,9 +1,10 @@
 import time
-from db import get_db
+from config import ADS_MAX_ATTEMPTS
+from db import get_db, transaction
 
 def create_order(user_id: int, text: str, link: str, price: float, currency: str):
     now = int(time.time())
-    with get_db() as db:
+    with transaction() as db:
         cur = db.execute(
             "INSERT INTO ads_orders(user_id, text, link, price, currency, status, created_at) "
             "VALUES (?,?,?,?,?,?,?)",
@@ -12,7 +13,7 @@ def create_order(user_id: int, text: str, link: str, price: float, currency: str
         return int(cur.lastrowid)
 
 def set_status(order_id: int, status: str):
-    with get_db() as db:
+    with transaction() as db:
         db.execute("UPDATE ads_orders SET status=? WHERE id=?", (status, order_id))
 
 def get_order(order_id: int):
@@ -20,13 +21,76 @@ def get_order(order_id: int):
         r = db.execute("SELECT * FROM ads_orders WHERE id=?", (order_id,)).fetchone()
         return dict(r) if r else None
 
-def list_pending_review():
-    with get_db() as db:
-        rows = db.execute("SELECT * FROM ads_orders WHERE status='pending_review' ORDER BY created_at ASC").fetchall()
-        return [dict(r) for r in rows]
-
 def pick_next_approved():
     with get_db() as db:
         r = db.execute("SELECT * FROM ads_orders WHERE status='approved' ORDER BY created_at ASC LIMIT 1").fetchone()
         return dict(r) if r else None
 
+
+# ---------------- moderation: pending_review -> approved / rejected ----------------
+def review_page(after: tuple | None = None, limit: int = 5):
+    # keyset page on idx_ads_orders_status: one range scan however deep the queue is.
+    # after = (created_at, id) of the previous page's last order -> (orders, has_next)
+    ts, oid = after or (0, 0)
+    with get_db() as db:
+        rows = db.execute(
+            "SELECT id, user_id, text, link, price, currency, created_at FROM ads_orders "
+            "WHERE status='pending_review' AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+            (ts, oid, limit + 1),
+        ).fetchall()
+    return [dict(r) for r in rows[:limit]], len(rows) > limit
+
+def review(order_ids: list, status: str) -> list:
+    # one UPDATE for the whole batch; orders no longer pending (another admin got there
+    # first) are left alone. -> ids actually changed
+    if status not in ("approved", "rejected"):
+        raise ValueError(f"bad review status: {status!r}")
+    if not order_ids:
+        return []
+    with transaction() as db:
+        rows = db.execute(
+            f"UPDATE ads_orders SET status=? WHERE status='pending_review' AND id IN ({','.join('?' * len(order_ids))}) "
+            "RETURNING id",
+            (status, *order_ids),
+        ).fetchall()
+    return sorted(r["id"] for r in rows)
+
+
+# ---------------- delivery: approved -> posting -> posted / failed ----------------
+def claim_next(channel_id: str, n: int = 1):
+    # one statement: concurrent claimers can never get the same order
+    now = int(time.time())
+    with transaction() as db:
+        rows = db.execute(
+            "UPDATE ads_orders SET status='posting', channel_id=?, claimed_at=? "
+            "WHERE id IN (SELECT id FROM ads_orders WHERE status='approved' ORDER BY created_at, id LIMIT ?) "
+            "RETURNING *",
+            (str(channel_id), now, n),
+        ).fetchall()
+    return sorted((dict(r) for r in rows), key=lambda r: (r["created_at"], r["id"]))
+
+def mark_posted(order_id: int):
+    with transaction() as db:
+        db.execute(
+            "UPDATE ads_orders SET status='posted', posted_at=? WHERE id=? AND status='posting'",
+            (int(time.time()), order_id),
+        )
+
+def mark_failed(order_id: int, error: str) -> str:
+    # back to the queue until ADS_MAX_ATTEMPTS, then 'failed' for good
+    with transaction() as db:
+        r = db.execute(
+            "UPDATE ads_orders SET attempts=attempts+1, last_error=?, channel_id=NULL, claimed_at=NULL, "
+            "status=CASE WHEN attempts+1 >= ? THEN 'failed' ELSE 'approved' END "
+            "WHERE id=? AND status='posting' RETURNING status",
+            (error[:500], ADS_MAX_ATTEMPTS, order_id),
+        ).fetchone()
+        return r["status"] if r else None
+
+def release_claims():
+    # boot: claims held in memory by a previous process are gone
+    with transaction() as db:
+        cur = db.execute(
+            "UPDATE ads_orders SET status='approved', channel_id=NULL, claimed_at=NULL WHERE status='posting'"
+        )
+        return cur.rowcount
@@ -0,0 +1,146 @@
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from config import ADS_CHANNELS, ADS_CHANNEL_ID, ADS_AUTOPOST_EVERY_MIN, ADS_PREFETCH_WINDOW_MIN
+from db import run_db
+from modules import ads, metrics
+from modules.concurrency import job_slot
+
+log = logging.getLogger("ads")
+
+
+def parse_slots(spec: str):
+    # "*/180" -> every 180 min; "09:00,15:00,21:00" -> local times of day
+    spec = spec.strip()
+    if spec.startswith("*/"):
+        return int(spec[2:]) * 60, ()
+    times = []
+    for part in spec.split(","):
+        h, _, m = part.strip().partition(":")
+        times.append(int(h) * 3600 + int(m or 0) * 60)
+    return None, tuple(sorted(times))
+
+
+def parse_channels(spec: str = ADS_CHANNELS):
+    # "-1001=09:00,15:00;-1002=*/120"; falls back to ADS_CHANNEL_ID every ADS_AUTOPOST_EVERY_MIN
+    channels = []
+    for part in spec.split(";"):
+        if not part.strip():
+            continue
+        chat_id, _, slots = part.partition("=")
+        every, times = parse_slots(slots or f"*/{ADS_AUTOPOST_EVERY_MIN}")
+        channels.append(Channel(int(chat_id), every, times))
+    if not channels and ADS_CHANNEL_ID:
+        channels.append(Channel(int(ADS_CHANNEL_ID), ADS_AUTOPOST_EVERY_MIN * 60, ()))
+    return channels
+
+
+@dataclass
+class Channel:
+    chat_id: int
+    every: int | None          # seconds between posts, or None for fixed times
+    times: tuple               # seconds since local midnight
+    buffer: deque = field(default_factory=deque)  # claimed ('posting') orders waiting for a slot
+    posted: int = 0
+    failed: int = 0
+    retried: int = 0
+    empty_slots: int = 0
+    last_post: float = 0.0
+    started: float = field(default_factory=time.time)
+
+    def next_slot(self, now: float) -> float:
+        if self.every:
+            return now + self.every
+        dt = datetime.fromtimestamp(now)
+        midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        for day in (0, 1):
+            base = midnight + timedelta(days=day)
+            for sec in self.times:
+                ts = (base + timedelta(seconds=sec)).timestamp()
+                if ts > now:
+                    return ts
+        return now + 86400
+
+    def slots_within(self, now: float, window: float) -> int:
+        n, t = 0, now
+        while True:
+            t = self.next_slot(t)
+            if t > now + window:
+                return max(1, n)
+            n += 1
+
+    def stats_line(self) -> str:
+        hours = max((time.time() - self.started) / 3600, 1.0)
+        last = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.last_post)) if self.last_post else "—"
+        return (
+            f"{self.chat_id}: posted {self.posted} ({self.posted / hours:.2f}/h), "
+            f"failed {self.failed}, retried {self.retried}, empty slots {self.empty_slots}, "
+            f"buffered {len(self.buffer)}, last {last}"
+        )
+
+
+# One one-shot job per channel, re-armed for the channel's next slot after every run.
+# When a channel's buffer is empty it claims as many approved orders as it has slots in
+# the next ADS_PREFETCH_WINDOW_MIN (one UPDATE ... RETURNING), then posts one per slot.
+class AdsPipeline:
+    def __init__(self, outbox, channels=None):
+        self.outbox = outbox
+        self.channels = parse_channels() if channels is None else channels
+
+    async def start(self, job_queue):
+        if not self.channels:
+            return
+        released = await run_db(ads.release_claims)
+        if released:
+            log.info("ads: released %d stale claims", released)
+        now = time.time()
+        for ch in self.channels:
+            first = 30 if ch.every else ch.next_slot(now) - now
+            self._arm(job_queue, ch, first)
+
+    def _arm(self, job_queue, ch: Channel, delay: float):
+        job_queue.run_once(self._run_slot, when=max(0.0, delay), data=ch, name=f"ads_slot:{ch.chat_id}")
+
+    @job_slot
+    @metrics.timed
+    async def _run_slot(self, context):
+        ch = context.job.data
+        try:
+            await self.post_next(ch)
+        finally:
+            now = time.time()
+            self._arm(context.job_queue, ch, ch.next_slot(now) - now)
+
+    async def post_next(self, ch: Channel):
+        if not ch.buffer:
+            n = ch.slots_within(time.time(), ADS_PREFETCH_WINDOW_MIN * 60)
+            ch.buffer.extend(await run_db(ads.claim_next, ch.chat_id, n))
+        if not ch.buffer:
+            ch.empty_slots += 1
+            return
+
+        ad = ch.buffer.popleft()
+        msg = ad["text"] + (f"\n{ad['link']}" if ad.get("link") else "")
+        try:
+            fut = await self.outbox.send(ch.chat_id, msg)
+            await fut
+        except Exception as e:
+            status = await run_db(ads.mark_failed, ad["id"], str(e))
+            if status == "failed":
+                ch.failed += 1
+            else:
+                ch.retried += 1
+            log.warning("ads: order #%s to %s failed (%s): %s", ad["id"], ch.chat_id, status, e)
+            return
+
+        await run_db(ads.mark_posted, ad["id"])
+        ch.posted += 1
+        ch.last_post = time.time()
+
+    def stats_text(self) -> str:
+        if not self.channels:
+            return "📣 ads autopost disabled"
+        return "📣 ads channels\n" + "\n".join(ch.stats_line() for ch in self.channels)
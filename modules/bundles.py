@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+from config import VIP_PRICE_STARS
+from locales import LANGS, check_locales
+from modules.language import LANG_KEYBOARD
+
+DEFAULT_LANG = "ua"
+
+
+# Everything a screen needs for one language, built once at import.
+# Templates already contain the localized labels; only the per-user values are left
+# as {fields}. Telegram markup objects are immutable and can be shared between messages.
+@dataclass(frozen=True)
+class Bundle:
+    lang: str
+    strings: MappingProxyType
+    main_menu: ReplyKeyboardMarkup
+    lang_keyboard: InlineKeyboardMarkup
+    ads_keyboard: InlineKeyboardMarkup
+    vip_keyboard: InlineKeyboardMarkup
+    menu_tpl: str       # {uid} {tickets} {vip}
+    balance_tpl: str    # {tickets} {vip} {until}
+    lottery_head: str   # {left}
+    lottery_row: str    # {place} {uid} {tickets}
+    lottery_foot: str
+
+    def t(self, key: str) -> str:
+        return self.strings[key]
+
+    def vip_status(self, active: bool) -> str:
+        return self.strings["vip_active"] if active else self.strings["vip_inactive"]
+
+
+def _esc(s: str) -> str:
+    # locale text goes into str.format templates
+    return s.replace("{", "{{").replace("}", "}}")
+
+
+def _compile(lang: str, strings: dict) -> Bundle:
+    s = {k: _esc(v) for k, v in strings.items()}
+    return Bundle(
+        lang=lang,
+        strings=MappingProxyType(dict(strings)),
+        main_menu=ReplyKeyboardMarkup(
+            [
+                [strings["earn"]],
+                [strings["ref"], strings["ads"]],
+                [strings["lottery"]],
+                [strings["balance"]],
+                [strings["donate"]],
+                [strings["lang"], strings["support"]],
+            ],
+            resize_keyboard=True,
+        ),
+        lang_keyboard=LANG_KEYBOARD,
+        ads_keyboard=InlineKeyboardMarkup([
+            [InlineKeyboardButton(strings["ad_buy"], callback_data="ads:buy")],
+            [InlineKeyboardButton(strings["ad_status"], callback_data="ads:status")],
+        ]),
+        vip_keyboard=InlineKeyboardMarkup(
+            [[InlineKeyboardButton(f"{strings['vip_buy']} — {VIP_PRICE_STARS} ⭐", callback_data="vip:info")]]
+        ),
+        menu_tpl=(
+            f"{s['menu_title']}\n\n"
+            f"👤 {s['your_id']}: {{uid}}\n"
+            f"🎟 {s['tickets']}: {{tickets}}\n"
+            f"{s['vip']}: {{vip}}"
+        ),
+        balance_tpl=(
+            f"🎟 {s['tickets']}: {{tickets}}\n"
+            f"{s['vip']}: {{vip}}\n"
+            f"⏳ VIP until: {{until}}"
+        ),
+        lottery_head=(
+            f"🎟 {s['lottery']}\n\n"
+            f"⏳ {s['lottery_left']}: {{left}}\n\n"
+            f"🏆 {s['lottery_top']}:\n"
+        ),
+        lottery_row="{place}. ID {uid} — {tickets} 🎟\n",
+        lottery_foot=f"\n{strings['lottery_join_hint']}",
+    )
+
+
+def compile_bundles():
+    check_locales()
+    if DEFAULT_LANG not in LANGS:
+        raise RuntimeError(f"locales: default language {DEFAULT_LANG!r} missing")
+    return MappingProxyType({lang: _compile(lang, strings) for lang, strings in LANGS.items()})
+
+
+BUNDLES = compile_bundles()
+
+
+def bundle(lang: str) -> Bundle:
+    b = BUNDLES.get(lang)
+    return b if b is not None else BUNDLES[DEFAULT_LANG]
@@ -0,0 +1,335 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Bot, Update
+
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    OUTBOX_GLOBAL_PER_SEC,
+    UPDATE_BACKLOG,
+    CLUSTER_QUEUE_SIZE,
+    CLUSTER_JOB_WORKER,
+)
+
+log = logging.getLogger("cluster")
+
+# Cluster mode (CLUSTER_WORKERS > 1): this process is the only one talking getUpdates /
+# webhook; it routes each raw update to worker i = key % n, where key is the same user (else
+# chat) id modules.concurrency orders by. A user's updates therefore always land in the same
+# worker and keep their order there. Each worker is a full Application (handlers, outbox,
+# persistence, caches) without an Updater.
+#
+# - Lottery close / ads jobs run in worker CLUSTER_JOB_WORKER only.
+# - Workers share the SQLite file; write transactions take one cross-process lock
+#   (db.set_write_lock) so they queue instead of spinning on SQLITE_BUSY.
+# - Each worker's outbox gets OUTBOX_GLOBAL_PER_SEC / n, keeping the bot within its limit.
+# - Backpressure: a busy worker stops reading its pipe, its buffer here fills up and the
+#   ingest stalls (polling waits, webhook answers 503 and Telegram redelivers).
+# - A worker that dies is restarted; updates still buffered here go to the new one.
+
+# update fields whose object carries the sender ("from" / "user") or a chat
+_ROUTED = (
+    "message", "edited_message", "channel_post", "edited_channel_post", "callback_query",
+    "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def route_key(data: dict) -> int:
+    # raw-payload twin of concurrency.update_key()
+    for field in _ROUTED:
+        obj = data.get(field)
+        if not obj:
+            continue
+        user = obj.get("from") or obj.get("user")
+        if user:
+            return user["id"]
+        chat = obj.get("chat") or (obj.get("message") or {}).get("chat")
+        return chat["id"] if chat else 0
+    return 0
+
+
+def partition(key: int, n: int) -> int:
+    return key % n
+
+
+# ---------------- worker process ----------------
+def _worker(index: int, conn, write_lock, jobs: bool, status, bot_factory):
+    # Ctrl+C / SIGTERM reach the whole process group: the supervisor decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    import db
+    import main
+
+    db.set_write_lock(write_lock)
+    main.cluster_role.update(index=index, jobs=jobs)
+    bot = bot_factory() if bot_factory else None
+    asyncio.run(_serve_worker(main, index, conn, status, bot))
+
+
+async def _serve_worker(main, index: int, conn, status, bot):
+    loop = asyncio.get_running_loop()
+    main.leaderboard.rebuild()
+    main.vip.load()
+    app = main.build_application(bot, update_queue=asyncio.Queue(maxsize=UPDATE_BACKLOG))
+
+    async def feed(data):
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    def read() -> int:
+        handled = 0
+        while True:
+            try:
+                batch = conn.recv()
+            except EOFError:  # supervisor gone
+                return handled
+            for data in batch:
+                if data is None:
+                    return handled
+                asyncio.run_coroutine_threadsafe(feed(data), loop).result()
+                handled += 1
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    status.put(("ready", index))
+    log.info("worker %d: ready (pid %d)", index, os.getpid())
+
+    handled = await loop.run_in_executor(None, read)
+    await app.update_queue.join()
+    await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    status.put(("done", index, handled))
+
+
+# ---------------- supervisor ----------------
+class WriteLock:
+    # db.transaction() lock shared by the workers; remembers its holder so the supervisor
+    # can free it when a worker dies inside a transaction
+    def __init__(self, ctx):
+        self._lock = ctx.Lock()
+        self._holder = ctx.Value("i", 0, lock=False)
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        ok = self._lock.acquire(timeout=timeout)
+        if ok:
+            self._holder.value = os.getpid()
+        return ok
+
+    def release(self):
+        self._holder.value = 0
+        self._lock.release()
+
+    def release_dead(self, pid: int) -> bool:
+        if self._holder.value != pid:
+            return False
+        self.release()
+        return True
+
+
+class Cluster:
+    def __init__(self, n: int, bot_factory=None, job_worker: int = CLUSTER_JOB_WORKER, queue_size: int = CLUSTER_QUEUE_SIZE):
+        # bot_factory: picklable fn() -> Bot for the workers (benchmarks); default is BOT_TOKEN
+        self.n = n
+        self.bot_factory = bot_factory
+        self.job_worker = job_worker % n
+        self._ctx = mp.get_context("spawn")
+        # per worker: a bounded buffer here (survives restarts) drained by a sender task into
+        # that worker's pipe; a restarted worker gets a new pipe
+        self.buffers = [asyncio.Queue(maxsize=queue_size) for _ in range(n)]
+        self.conns = [None] * n
+        self.procs = [None] * n
+        self.write_lock = WriteLock(self._ctx)
+        self.status = self._ctx.Queue()
+        self.dispatched = [0] * n
+        self.restarts = 0
+        self._senders = []
+        self._pool = ThreadPoolExecutor(max_workers=n, thread_name_prefix="cluster-send")
+        self._draining = False  # stop(): workers exit (code 0) once their buffer is empty
+        self._stopping = False
+
+    def _spawn(self, i: int):
+        reader, writer = self._ctx.Pipe(duplex=False)
+        p = self._ctx.Process(
+            target=_worker,
+            name=f"bot-worker-{i}",
+            args=(i, reader, self.write_lock, i == self.job_worker, self.status, self.bot_factory),
+        )
+        p.start()
+        reader.close()  # a dead worker then fails our send() instead of blocking it
+        self.procs[i] = p
+        self.conns[i] = writer
+
+    async def start(self, timeout: float = 60.0):
+        loop = asyncio.get_running_loop()
+        # read by config in the (spawned) workers
+        os.environ["OUTBOX_GLOBAL_PER_SEC"] = str(OUTBOX_GLOBAL_PER_SEC / self.n)
+        for i in range(self.n):
+            self._spawn(i)
+        ready = set()
+        while len(ready) < self.n:
+            try:
+                msg = await loop.run_in_executor(None, self.status.get, True, timeout)
+            except queue.Empty:
+                raise RuntimeError(f"cluster: workers {sorted(set(range(self.n)) - ready)} did not start")
+            if msg[0] == "ready":
+                ready.add(msg[1])
+        self._senders = [asyncio.create_task(self._sender(i)) for i in range(self.n)]
+        log.info("cluster: %d workers up, jobs on worker %d", self.n, self.job_worker)
+
+    async def dispatch(self, data: dict):
+        i = partition(route_key(data), self.n)
+        await self.buffers[i].put(data)
+        self.dispatched[i] += 1
+
+    async def _sender(self, i: int):
+        loop = asyncio.get_running_loop()
+        buf = self.buffers[i]
+        while True:
+            batch = [await buf.get()]
+            while batch[-1] is not None and len(batch) < 256 and not buf.empty():
+                batch.append(buf.get_nowait())
+            while True:
+                conn = self.conns[i]
+                try:
+                    await loop.run_in_executor(self._pool, conn.send, batch)
+                    break
+                except OSError:
+                    # worker died: resend to its replacement. What it had already read
+                    # is lost, as with a crash of a single-process bot
+                    if self._stopping:
+                        log.error("cluster: worker %d gone at shutdown, %d updates dropped", i, len(batch))
+                        return
+                    while self.conns[i] is conn and not self._stopping:
+                        await asyncio.sleep(0.1)
+            if batch[-1] is None:
+                return
+
+    async def watch(self, interval: float = 1.0):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for i, p in enumerate(self.procs):
+                if self._stopping or p.is_alive() or (self._draining and p.exitcode == 0):
+                    continue
+                log.error("cluster: worker %d exited with %s, restarting", i, p.exitcode)
+                if self.write_lock.release_dead(p.pid):
+                    log.warning("cluster: worker %d died holding the write lock, released", i)
+                self.conns[i].close()
+                self.restarts += 1
+                self._spawn(i)
+
+    async def stop(self, timeout: float = 30.0) -> int:
+        # workers finish what is queued for them, then shut down like a single process would
+        loop = asyncio.get_running_loop()
+        self._draining = True
+        for buf in self.buffers:
+            await buf.put(None)
+        await asyncio.gather(*self._senders)
+        self._stopping = True
+        for i, p in enumerate(self.procs):
+            await loop.run_in_executor(None, p.join, timeout)
+            if p.is_alive():
+                log.warning("cluster: worker %d did not stop in %.0fs, killing it", i, timeout)
+                p.kill()
+                p.join()
+            self.conns[i].close()
+        self._pool.shutdown()
+        handled = 0
+        while True:
+            try:
+                msg = self.status.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "done":
+                handled += msg[2]
+        return handled
+
+
+# ---------------- ingest ----------------
+async def _ingest_polling(cluster: Cluster, bot: Bot, stop: asyncio.Event):
+    await bot.delete_webhook()
+    offset = None
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        while not stop.is_set():
+            # only the long poll is cancelled on stop; dispatched updates are always confirmed
+            fetch = asyncio.create_task(bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES))
+            await asyncio.wait({fetch, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if not fetch.done():
+                fetch.cancel()
+                break
+            try:
+                batch = fetch.result()
+            except Exception:
+                log.exception("cluster: getUpdates failed")
+                await asyncio.sleep(3)
+                continue
+            for u in batch:
+                await cluster.dispatch(u.to_dict())
+                offset = u.update_id + 1
+    finally:
+        stopped.cancel()
+        if offset is not None:
+            await bot.get_updates(offset=offset, timeout=0)
+
+
+async def _ingest_webhook(cluster: Cluster, bot: Bot, stop: asyncio.Event):
+    from modules.webhook import WebhookServer
+
+    server = WebhookServer(None, sink=cluster.dispatch)
+    await server.start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        log.info("WEBHOOK_URL empty: not registering with Telegram (local mode)")
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+
+
+async def _supervise(n: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    cluster = Cluster(n)
+    await cluster.start()
+    watchdog = asyncio.create_task(cluster.watch())
+    try:
+        async with Bot(BOT_TOKEN) as bot:
+            if BOT_MODE == "webhook":
+                await _ingest_webhook(cluster, bot, stop)
+            else:
+                await _ingest_polling(cluster, bot, stop)
+    finally:
+        handled = await cluster.stop()
+        watchdog.cancel()
+        log.info("cluster: stopped, %d updates dispatched, %d handled, %d restarts", sum(cluster.dispatched), handled, cluster.restarts)
+
+
+def run_cluster(n: int):
+    asyncio.run(_supervise(n))
@@ -0,0 +1,88 @@
+import asyncio
+import functools
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_CONCURRENCY, UPDATE_BACKLOG, JOB_CONCURRENCY
+
+
+def update_key(update) -> int | None:
+    # updates with the same key run one at a time, in arrival order
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+# Updates of different users run concurrently (at most UPDATE_CONCURRENCY handlers at once);
+# updates of one user run in the order they arrived, each after the previous one finished.
+# The Application starts a task per update in arrival order and the task joins its user's
+# chain before its first await, so the chain order is the arrival order.
+#
+# The base class semaphore (UPDATE_BACKLOG) only caps how many update tasks may exist,
+# including those waiting for their turn; a user's backlog doesn't take handler slots.
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, backlog: int = UPDATE_BACKLOG):
+        super().__init__(max(backlog, concurrency))
+        self.concurrency = concurrency
+        self._slots = None
+        self._tails = {}  # key -> future done when that key's latest update has finished
+
+    async def initialize(self) -> None:
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        prev = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        started = False
+        try:
+            if prev is not None:
+                await prev
+            async with self._slots:
+                started = True
+                await coroutine
+        finally:
+            if not started:
+                coroutine.close()  # cancelled while waiting
+            if prev is not None and not prev.done():
+                # still waiting for the previous update: hand its completion on
+                prev.add_done_callback(lambda _: self._release(key, done))
+            else:
+                self._release(key, done)
+
+    def _release(self, key, done):
+        done.set_result(None)
+        if self._tails.get(key) is done:
+            del self._tails[key]
+
+    def backlog(self) -> int:
+        return len(self._tails)
+
+
+# JobQueue callbacks don't go through the update processor; they get their own budget so a
+# burst of jobs can't starve updates (and the other way round).
+_job_slots = None
+
+
+def job_slot(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        global _job_slots
+        if _job_slots is None:
+            _job_slots = asyncio.Semaphore(JOB_CONCURRENCY)
+        async with _job_slots:
+            return await fn(*args, **kwargs)
+    return wrapper
@@ -1,4 +1,5 @@
-from db import add_donation, top_donors
+from db import add_donation
+from modules.leaderboard import top_donors
 
 def register_donation(user_id: int, amount: float, currency: str):
     add_donation(user_id, amount, currency)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+
+from config import ADMIN_IDS, FLOOD_USER, FLOOD_CHAT, FLOOD_MAX_KEYS, FLOOD_IDLE_SEC
+
+log = logging.getLogger("flood")
+
+KINDS = ("command", "callback", "text")
+
+
+def parse_limits(spec: str) -> dict:
+    # "command=1:5,callback=2:10,text=1:5" -> {kind: (tokens per second, burst)}
+    limits = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        kind, _, v = part.partition("=")
+        rate, _, burst = v.partition(":")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise RuntimeError(f"flood limits: unknown kind {kind!r}")
+        limits[kind] = (float(rate), float(burst or rate))
+    return limits
+
+
+# Token buckets keyed by (scope, kind, id), kept in access order. A bucket idle for
+# FLOOD_IDLE_SEC is full again anyway, so dropping it changes nothing; FLOOD_MAX_KEYS caps
+# memory (least recently used buckets go first).
+class Limiter:
+    def __init__(self, user_limits: dict, chat_limits: dict, max_keys: int = FLOOD_MAX_KEYS, idle: float = FLOOD_IDLE_SEC):
+        self.limits = {"user": user_limits, "chat": chat_limits}
+        self.max_keys = max_keys
+        self.idle = idle
+        self.dropped = Counter()
+        self._buckets = OrderedDict()  # key -> [tokens, last refill]
+
+    def _take(self, key, rate: float, burst: float, now: float) -> bool:
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = [burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            b[0] = min(burst, b[0] + (now - b[1]) * rate)
+            b[1] = now
+        if b[0] < 1:
+            return False
+        b[0] -= 1
+        return True
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, b = next(iter(buckets.items()))
+            if len(buckets) <= self.max_keys and now - b[1] < self.idle:
+                break
+            buckets.popitem(last=False)
+
+    def allow(self, kind: str, user_id: int | None, chat_id: int | None) -> bool:
+        # event loop only (called from guard), so no locking
+        now = time.monotonic()
+        ok = True
+        for scope, ident in (("user", user_id), ("chat", chat_id)):
+            lim = self.limits[scope].get(kind)
+            if lim and ident is not None and not self._take((scope, kind, ident), lim[0], lim[1], now):
+                ok = False
+                break
+        self._evict(now)
+        if not ok:
+            self.dropped[kind] += 1
+        return ok
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+limiter = Limiter(parse_limits(FLOOD_USER), parse_limits(FLOOD_CHAT))
+
+
+def update_kind(update: Update) -> str | None:
+    if update.callback_query:
+        return "callback"
+    msg = update.message
+    if msg and msg.text:
+        ents = msg.entities
+        if ents and ents[0].type == "bot_command" and ents[0].offset == 0:
+            return "command"
+        return "text"
+    return None
+
+
+# Group -1 handler. The verdict is made in check_update(): the Application builds the
+# CallbackContext (and with it the persistence refresh_*_data() read from SQLite) only once
+# a handler matches, so a dropped update must stop there. Raising ApplicationHandlerStop from
+# check_update ends processing of the update; allowed updates simply don't match.
+class FloodGuard(TypeHandler):
+    def __init__(self):
+        super().__init__(Update, _never_called)
+        self._answers = set()
+
+    def check_update(self, update: object) -> bool:
+        # event loop, never touches the DB
+        if not isinstance(update, Update):
+            return False
+        kind = update_kind(update)
+        if kind is None:
+            return False
+        user = update.effective_user
+        if user and user.id in ADMIN_IDS:
+            return False
+        chat = update.effective_chat
+        if limiter.allow(kind, user.id if user else None, chat.id if chat else None):
+            return False
+
+        log.debug("dropped %s from user %s", kind, user.id if user else None)
+
+        if kind == "callback":
+            # stop the button's loading spinner; no other reply to a flooder
+            task = asyncio.create_task(_answer(update.callback_query))
+            self._answers.add(task)
+            task.add_done_callback(self._answers.discard)
+        raise ApplicationHandlerStop
+
+
+async def _answer(query):
+    try:
+        await query.answer()
+    except Exception:
+        pass
+
+
+async def _never_called(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    pass
@@ -2,12 +2,15 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from locales import LANGS
 from db import set_lang
 
+# built once; telegram objects are immutable, so one instance serves every message
+LANG_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🇺🇦 Українська", callback_data="lang:ua")],
+    [InlineKeyboardButton("🇬🇧 English", callback_data="lang:en")],
+    [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang:ru")],
+])
+
 def lang_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🇺🇦 Українська", callback_data="lang:ua")],
-        [InlineKeyboardButton("🇬🇧 English", callback_data="lang:en")],
-        [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang:ru")],
-    ])
+    return LANG_KEYBOARD
 
 def apply_lang_choice(user_id: int, lang: str):
     if lang not in LANGS:
@@ -0,0 +1,115 @@
+import logging
+import threading
+from config import LEADERBOARD_SIZE
+from db import get_db, on_user_value
+
+log = logging.getLogger("leaderboard")
+
+# In-memory top lists for users.tickets and users.donated_total.
+#
+# Each board keeps up to 2 * LEADERBOARD_SIZE members plus `bound`: the highest value any
+# non-member can have. Members with value >= bound are ranked exactly; if fewer than
+# requested are valid (a member dropped below bound) the board is rebuilt from SQLite.
+# Only users with a positive value are ranked.
+BOARDS = {
+    "tickets": "SELECT user_id, tickets AS v FROM users WHERE tickets>0 ORDER BY tickets DESC LIMIT ?",
+    "donated_total": "SELECT user_id, donated_total AS v FROM users WHERE donated_total>0 ORDER BY donated_total DESC LIMIT ?",
+}
+CAPACITY = LEADERBOARD_SIZE * 2
+
+_lock = threading.RLock()
+_members = {name: {} for name in BOARDS}  # board -> {user_id: value}
+_bound = {name: 0 for name in BOARDS}
+_ranked = {name: None for name in BOARDS}  # sorted view, dropped on change
+_built = False
+
+def _load(name: str, limit: int):
+    with get_db() as db:
+        rows = db.execute(BOARDS[name], (limit,)).fetchall()
+        return [(int(r["user_id"]), r["v"]) for r in rows]
+
+def rebuild(name: str | None = None):
+    global _built
+    for n in ([name] if name else BOARDS):
+        # a write committing while this runs can be lost; check_drift() catches that
+        with _lock:
+            rows = _load(n, CAPACITY)
+            _members[n] = dict(rows)
+            # table fits the board -> nobody outside it has a positive value
+            _bound[n] = rows[-1][1] if len(rows) == CAPACITY else 0
+            _ranked[n] = None
+    _built = True
+
+def _ranking(name: str):
+    r = _ranked[name]
+    if r is None:
+        bound = _bound[name]
+        r = sorted(
+            ((uid, v) for uid, v in _members[name].items() if v >= bound and v > 0),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+        _ranked[name] = r
+    return r
+
+def top(name: str, limit: int = 5):
+    with _lock:
+        if not _built:
+            rebuild()
+        r = _ranking(name)
+        if len(r) >= limit or _bound[name] == 0:
+            return r[:limit]
+    # not enough exactly-ranked members left
+    log.info("leaderboard %s: rebuilding (valid=%d < %d)", name, len(r), limit)
+    rebuild(name)
+    with _lock:
+        return _ranking(name)[:limit]
+
+def top_from_sql(name: str, limit: int):
+    # exact ranking for payouts: the board only sees this process's writes and can lag
+    # (other workers, scripts) until check_drift() rebuilds it
+    return _load(name, limit)
+
+def top_tickets(limit: int = 5):
+    return [{"user_id": uid, "tickets": v} for uid, v in top("tickets", limit)]
+
+def top_donors(limit: int = 5):
+    return [{"user_id": uid, "donated_total": v} for uid, v in top("donated_total", limit)]
+
+@on_user_value
+def _on_value(user_id: int, column: str, value):
+    if column not in BOARDS or not _built:
+        return
+    with _lock:
+        members = _members[column]
+        bound = _bound[column]
+        if user_id in members:
+            if value >= bound and value > 0:
+                members[user_id] = value
+            else:
+                # may now rank below someone we don't track
+                del members[user_id]
+        elif value > bound:
+            members[user_id] = value
+            if len(members) > CAPACITY:
+                out = min(members, key=members.get)
+                _bound[column] = max(bound, members.pop(out))
+        else:
+            return
+        _ranked[column] = None
+
+def check_drift(limit: int = LEADERBOARD_SIZE):
+    # compare with SQL; ties may come back in any order, so compare the value sequences
+    # and the users strictly above the last value
+    drift = {}
+    for name in BOARDS:
+        sql = _load(name, limit)
+        mem = top(name, limit)
+        if [v for _, v in sql] == [v for _, v in mem]:
+            last = sql[-1][1] if sql else None
+            if {u for u, v in sql if v != last} == {u for u, v in mem if v != last}:
+                continue
+        drift[name] = {"sql": sql[:5], "memory": mem[:5]}
+        log.warning("leaderboard %s drifted from SQL, rebuilding", name)
+        rebuild(name)
+    return drift
@@ -1,7 +1,11 @@
 import time
+import heapq
+import math
 import random
-from config import LOTTERY_PERIOD_HOURS
-from db import get_db
+import secrets
+from config import LOTTERY_PERIOD_HOURS, LOTTERY_WINNERS, LOTTERY_DRAW_CHUNK
+from db import get_db, transaction, apply_credits, count_tickets, invalidate_user, notify_user_value
+from modules import leaderboard
 
 def get_current_cycle():
     with get_db() as db:
@@ -17,62 +21,144 @@ def time_left_str(ends_at: int) -> str:
     s = left % 60
     return f"{h:02d}:{m:02d}:{s:02d}"
 
+class _NoEntry(Exception):
+    pass
+
 def join_lottery(cycle_id: int, user_id: int, tickets: int):
+    # spend `tickets` from the balance into the cycle, atomically.
+    # Returns (new_balance, tickets_in_cycle), or None if the balance is short or the cycle is closed.
+    try:
+        with transaction() as db:
+            e = db.execute(
+                "INSERT INTO lottery_entries(cycle_id, user_id, tickets) "
+                "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM lottery_cycles WHERE id=? AND closed=0) "
+                "ON CONFLICT(cycle_id, user_id) DO UPDATE SET tickets=tickets+excluded.tickets "
+                "RETURNING tickets",
+                (cycle_id, user_id, tickets, cycle_id),
+            ).fetchone()
+            if not e:
+                raise _NoEntry
+            r = db.execute(
+                "UPDATE users SET tickets=tickets-? WHERE user_id=? AND tickets>=? RETURNING tickets",
+                (tickets, user_id, tickets),
+            ).fetchone()
+            if not r:
+                raise _NoEntry  # rolls the entry back
+            count_tickets(db, "lottery", spent=tickets)
+            notify_user_value(user_id, "tickets", r[0])
+    except _NoEntry:
+        return None
+    finally:
+        invalidate_user(user_id)
+    return int(r[0]), int(e[0])
+
+# ---------------- draw engine ----------------
+# Entries are streamed in user_id order (the PK order, so no sort) and never
+# expanded per ticket. The same seed over the same entries replays the same draw.
+def iter_entries(db, cycle_id: int, chunk: int = LOTTERY_DRAW_CHUNK):
+    cur = db.execute(
+        "SELECT user_id, tickets FROM lottery_entries WHERE cycle_id=? AND tickets>0 ORDER BY user_id",
+        (cycle_id,),
+    )
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            return
+        for r in rows:
+            yield int(r[0]), int(r[1])
+
+def new_seed() -> int:
+    return secrets.randbits(63)  # fits a signed SQLite INTEGER
+
+def weighted_draw(entries, k: int = 1, seed: int | None = None):
+    # entries: iterable of (user_id, tickets) -> (up to k distinct winners in draw order, seed)
+    if seed is None:
+        seed = new_seed()
+    rng = random.Random(seed)
+
+    if k == 1:
+        # one pass, O(1) memory: entry i takes over the pick with p = w_i / (w_1 + ... + w_i)
+        total = 0
+        winner = None
+        for uid, w in entries:
+            total += w
+            if rng.random() * total < w:
+                winner = uid
+        return ([winner] if winner is not None else []), seed
+
+    # without replacement (Efraimidis-Spirakis A-Res): key = u^(1/w), keep the k largest -> O(k) memory
+    heap = []
+    for uid, w in entries:
+        key = math.log(1.0 - rng.random()) / w
+        if len(heap) < k:
+            heapq.heappush(heap, (key, uid))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, uid))
+    return [uid for _, uid in sorted(heap, reverse=True)], seed
+
+def draw(cycle_id: int, k: int = 1, seed: int | None = None):
     with get_db() as db:
-        row = db.execute(
-            "SELECT tickets FROM lottery_entries WHERE cycle_id=? AND user_id=?",
-            (cycle_id, user_id),
-        ).fetchone()
-        if row:
-            db.execute(
-                "UPDATE lottery_entries SET tickets=tickets+? WHERE cycle_id=? AND user_id=?",
-                (tickets, cycle_id, user_id),
-            )
-        else:
-            db.execute(
-                "INSERT INTO lottery_entries(cycle_id, user_id, tickets) VALUES (?,?,?)",
-                (cycle_id, user_id, tickets),
-            )
+        return weighted_draw(iter_entries(db, cycle_id), k, seed)
+
+def pick_winner(cycle_id: int, seed: int | None = None):
+    winners, _ = draw(cycle_id, 1, seed)
+    return winners[0] if winners else None
 
-def pick_winner(cycle_id: int):
+def get_winners(cycle_id: int):
     with get_db() as db:
         rows = db.execute(
-            "SELECT user_id, tickets FROM lottery_entries WHERE cycle_id=?",
+            "SELECT user_id FROM lottery_winners WHERE cycle_id=? ORDER BY place",
             (cycle_id,),
         ).fetchall()
-    pool = []
-    for r in rows:
-        pool.extend([int(r["user_id"])] * int(r["tickets"]))
-    if not pool:
-        return None
-    return random.choice(pool)
+        return [int(r["user_id"]) for r in rows]
 
-def close_cycle_and_start_new():
-    now = int(time.time())
+def replay_draw(cycle_id: int):
+    # audit: re-run a closed cycle's draw from its recorded seed
     with get_db() as db:
-        cycle = db.execute("SELECT * FROM lottery_cycles ORDER BY id DESC LIMIT 1").fetchone()
+        c = db.execute("SELECT draw_seed FROM lottery_cycles WHERE id=?", (cycle_id,)).fetchone()
+        if not c or c["draw_seed"] is None:
+            return None
+        k = db.execute("SELECT COUNT(*) FROM lottery_winners WHERE cycle_id=?", (cycle_id,)).fetchone()[0]
+        winners, _ = weighted_draw(iter_entries(db, cycle_id), max(1, k), int(c["draw_seed"]))
+        return winners
+
+def close_cycle_and_start_new(cycle_id: int | None = None):
+    # close -> draw -> open next in one write transaction. Idempotent: a cycle that is
+    # already closed, not due yet, or not the one the caller armed for is left alone.
+    now = int(time.time())
+    with transaction() as db:
+        cycle = db.execute("SELECT * FROM lottery_cycles WHERE closed=0 ORDER BY id DESC LIMIT 1").fetchone()
         if not cycle:
             db.execute("INSERT INTO lottery_cycles(ends_at, started_at, closed) VALUES (?,?,0)", (now + LOTTERY_PERIOD_HOURS * 3600, now))
             return None, None
 
         cycle = dict(cycle)
-        if cycle["closed"] == 1:
+        if (cycle_id is not None and cycle["id"] != cycle_id) or int(cycle["ends_at"]) > now:
             return None, None
 
-        winner = pick_winner(cycle["id"])
-        db.execute("UPDATE lottery_cycles SET winner_id=?, closed=1 WHERE id=?", (winner, cycle["id"]))
+        winners, seed = weighted_draw(iter_entries(db, cycle["id"]), LOTTERY_WINNERS)
+        winner = winners[0] if winners else None
+        cur = db.execute(
+            "UPDATE lottery_cycles SET winner_id=?, draw_seed=?, closed=1 WHERE id=? AND closed=0",
+            (winner, seed, cycle["id"]),
+        )
+        if cur.rowcount != 1:
+            return None, None
+        db.executemany(
+            "INSERT INTO lottery_winners(cycle_id, place, user_id) VALUES (?,?,?)",
+            [(cycle["id"], place, uid) for place, uid in enumerate(winners, 1)],
+        )
         db.execute("INSERT INTO lottery_cycles(ends_at, started_at, closed) VALUES (?,?,0)", (now + LOTTERY_PERIOD_HOURS * 3600, now))
+        cycle["winners"] = winners
+        cycle["draw_seed"] = seed
         return cycle, winner
 
 def distribute_rewards():
-    with get_db() as db:
-        rows = db.execute(
-            "SELECT user_id, tickets FROM users ORDER BY tickets DESC LIMIT 50"
-        ).fetchall()
-
-    for i, r in enumerate(rows, 1):
-        uid = r["user_id"]
+    # money goes out: rank from SQLite, not from the in-memory board
+    rows = leaderboard.top_from_sql("tickets", 50)
+    credits = []
 
+    for i, (uid, _) in enumerate(rows, 1):
         if i <= 5:
             reward = 300
         elif i <= 15:
@@ -80,4 +166,6 @@ def distribute_rewards():
         else:
             reward = 50
 
-        add_donation(uid, reward, "XTR")
+        credits.append((uid, reward, "XTR", "lottery_reward"))
+
+    return apply_credits(credits)
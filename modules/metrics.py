@@ -0,0 +1,216 @@
+import asyncio
+import bisect
+import functools
+import logging
+import sqlite3
+import threading
+import time
+
+from config import METRICS_ENABLED, METRICS_LISTEN, METRICS_PORT, SLOW_QUERY_MS
+
+log = logging.getLogger("metrics")
+
+# Latency histograms + error counters for handlers / jobs, timing for every SQL statement,
+# exposed in Prometheus text format. With METRICS_ENABLED off, timed() returns the function
+# itself and db uses the plain sqlite3.Connection, so there is nothing left to pay for.
+ENABLED = METRICS_ENABLED
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, v: float):
+        i = bisect.bisect_left(BUCKETS, v)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+
+# metric name -> (help, type, {label value: Histogram | number})
+_metrics = {
+    "bot_handler_seconds": ("Handler / job latency", "histogram", {}),
+    "bot_handler_errors_total": ("Handler / job exceptions", "counter", {}),
+    "bot_sql_seconds": ("SQL statement time (execute / executemany)", "histogram", {}),
+    "bot_sql_slow_total": (f"SQL statements slower than {SLOW_QUERY_MS:g} ms", "counter", {}),
+}
+_labels = {"bot_handler_seconds": "handler", "bot_handler_errors_total": "handler", "bot_sql_seconds": "op", "bot_sql_slow_total": "op"}
+_gauges = []  # (name, help, type, fn -> number | {label: number}, label)
+_lock = threading.Lock()
+
+
+def _hist(name: str, label: str) -> Histogram:
+    series = _metrics[name][2]
+    h = series.get(label)
+    if h is None:
+        with _lock:
+            h = series.setdefault(label, Histogram())
+    return h
+
+
+def _inc(name: str, label: str):
+    series = _metrics[name][2]
+    with _lock:
+        series[label] = series.get(label, 0) + 1
+
+
+def register_gauge(name: str, help: str, fn, kind: str = "gauge", label: str = "name"):
+    # fn is called at scrape time
+    _gauges.append((name, help, kind, fn, label))
+
+
+# ---------------- handlers / jobs ----------------
+def timed(fn, name: str | None = None):
+    if not ENABLED:
+        return fn
+    name = name or getattr(fn, "__name__", repr(fn))
+    h = _hist("bot_handler_seconds", name)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            _inc("bot_handler_errors_total", name)
+            raise
+        finally:
+            h.observe(time.perf_counter() - t)
+    return wrapper
+
+
+def instrument_handlers(app):
+    # wraps the callback of every handler registered on the application
+    if not ENABLED:
+        return
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = timed(handler.callback)
+
+
+# ---------------- SQL ----------------
+_sql_hists = {}  # statement text -> (op, Histogram); statements are constants in the code
+
+
+def _sql_hist(sql: str):
+    r = _sql_hists.get(sql)
+    if r is None:
+        op = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "?"
+        r = (op, _hist("bot_sql_seconds", op))
+        if len(_sql_hists) < 10000:
+            _sql_hists[sql] = r
+    return r
+
+
+def _observe_sql(sql: str, elapsed: float):
+    op, h = _sql_hist(sql)
+    h.observe(elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _inc("bot_sql_slow_total", op)
+        log.warning("slow query %.1f ms: %s", elapsed * 1000, " ".join(sql.split())[:300])
+
+
+class TracedConnection(sqlite3.Connection):
+    # connection factory for db._connect(). Times execute / executemany, which covers
+    # writes completely and reads up to their first row (fetches are not timed).
+    def execute(self, sql, *args):
+        t = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            _observe_sql(sql, time.perf_counter() - t)
+
+    def executemany(self, sql, *args):
+        t = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            _observe_sql(sql, time.perf_counter() - t)
+
+
+def connection_factory():
+    return TracedConnection if ENABLED else sqlite3.Connection
+
+
+# ---------------- Prometheus text ----------------
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    out = []
+    for name, (help, kind, series) in _metrics.items():
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        label = _labels[name]
+        for value, m in sorted(series.items()):
+            lv = f'{label}="{_esc(value)}"'
+            if kind != "histogram":
+                out.append(f"{name}{{{lv}}} {m}")
+                continue
+            with m.lock:
+                counts, total, n = list(m.counts), m.sum, m.count
+            acc = 0
+            for le, c in zip(BUCKETS + ("+Inf",), counts):
+                acc += c
+                out.append(f'{name}_bucket{{{lv},le="{le}"}} {acc}')
+            out.append(f"{name}_sum{{{lv}}} {total}")
+            out.append(f"{name}_count{{{lv}}} {n}")
+    for name, help, kind, fn, label in _gauges:
+        try:
+            v = fn()
+        except Exception:
+            log.exception("metrics: gauge %s failed", name)
+            continue
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        if isinstance(v, dict):
+            out.extend(f'{name}{{{label}="{_esc(k)}"}} {x}' for k, x in v.items())
+        else:
+            out.append(f"{name} {v}")
+    return "\n".join(out) + "\n"
+
+
+class MetricsServer:
+    # GET /metrics only; one request per connection
+    def __init__(self):
+        self._server = None
+
+    async def start(self, host: str = METRICS_LISTEN, port: int = METRICS_PORT):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        log.info("metrics on http://%s:%s/metrics", host, port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
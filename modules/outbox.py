@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from config import (
+    OUTBOX_GLOBAL_PER_SEC,
+    OUTBOX_PER_CHAT_SEC,
+    OUTBOX_WORKERS,
+    OUTBOX_QUEUE_SIZE,
+    OUTBOX_MAX_RETRIES,
+)
+
+log = logging.getLogger("outbox")
+
+
+@dataclass
+class Report:
+    delivered: int = 0
+    failed: int = 0
+    throttled: int = 0  # RetryAfter hits / per-chat deferrals
+    retried: int = 0
+
+    def text(self) -> str:
+        return (
+            f"delivered: {self.delivered}\n"
+            f"failed: {self.failed}\n"
+            f"throttled: {self.throttled}\n"
+            f"retried: {self.retried}"
+        )
+
+
+@dataclass
+class _Job:
+    chat_id: int
+    text: str
+    kwargs: dict
+    future: asyncio.Future
+    report: Report | None
+    attempt: int = 0
+
+
+@dataclass
+class _Bucket:
+    rate: float
+    tokens: float = 0.0
+    last: float = field(default_factory=time.monotonic)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Outgoing messages: sent concurrently by OUTBOX_WORKERS tasks, at most OUTBOX_GLOBAL_PER_SEC
+# overall and one per OUTBOX_PER_CHAT_SEC per chat. RetryAfter pauses every worker for the
+# requested time; timeouts / network errors are retried with backoff; Forbidden / BadRequest
+# (blocked bot, bad chat) fail at once.
+class Outbox:
+    def __init__(self):
+        self.bot = None
+        self.stats = Report()
+        self._queue = None
+        self._workers = []
+        self._bucket = _Bucket(OUTBOX_GLOBAL_PER_SEC)
+        self._chat_next = {}  # chat_id -> monotonic time of the next allowed send
+        self._paused_until = 0.0
+        self._deferred = 0
+
+    def start(self, bot):
+        self.bot = bot
+        self._queue = asyncio.Queue(maxsize=OUTBOX_QUEUE_SIZE)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(OUTBOX_WORKERS)]
+
+    async def stop(self, timeout: float = 10.0):
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("outbox: %d messages dropped at shutdown", self._queue.qsize() + self._deferred)
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def send(self, chat_id: int, text: str, report: Report | None = None, **kwargs) -> asyncio.Future:
+        # waits only for queue space, not for delivery; await the returned future for that
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Job(chat_id, text, kwargs, fut, report))
+        return fut
+
+    async def _drain(self):
+        while True:
+            await self._queue.join()
+            if not self._deferred:
+                return
+            await asyncio.sleep(0.1)
+
+    async def _requeue_later(self, job: _Job, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self._queue.put(job)
+        finally:
+            self._deferred -= 1
+
+    def _defer(self, job: _Job, delay: float):
+        self._deferred += 1
+        asyncio.create_task(self._requeue_later(job, delay))
+
+    def _count(self, job: _Job, name: str):
+        setattr(self.stats, name, getattr(self.stats, name) + 1)
+        if job.report is not None:
+            setattr(job.report, name, getattr(job.report, name) + 1)
+
+    def _finish(self, job: _Job, result=None, error=None):
+        self._count(job, "failed" if error else "delivered")
+        if not job.future.done():
+            if error:
+                job.future.set_exception(error)
+                job.future.exception()  # fire-and-forget callers never retrieve it
+            else:
+                job.future.set_result(result)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                log.exception("outbox: unexpected error for chat %s", job.chat_id)
+                self._finish(job, error=e)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: _Job):
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._defer(job, self._paused_until - now)
+            return
+
+        ready = self._chat_next.get(job.chat_id, 0.0)
+        if now < ready:
+            self._count(job, "throttled")
+            self._defer(job, ready - now)
+            return
+        self._chat_next[job.chat_id] = now + OUTBOX_PER_CHAT_SEC
+        if len(self._chat_next) > OUTBOX_QUEUE_SIZE * 2:
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+        await self._bucket.acquire()
+        try:
+            msg = await self.bot.send_message(chat_id=job.chat_id, text=job.text, **job.kwargs)
+        except RetryAfter as e:
+            self._count(job, "throttled")
+            self._paused_until = time.monotonic() + e.retry_after
+            log.warning("outbox: flood limit, pausing %ss", e.retry_after)
+            self._defer(job, e.retry_after)
+        except (Forbidden, BadRequest) as e:
+            log.info("outbox: chat %s: %s", job.chat_id, e)
+            self._finish(job, error=e)
+        except (TimedOut, NetworkError) as e:
+            job.attempt += 1
+            if job.attempt > OUTBOX_MAX_RETRIES:
+                log.warning("outbox: chat %s failed after %d attempts: %s", job.chat_id, job.attempt, e)
+                self._finish(job, error=e)
+                return
+            self._count(job, "retried")
+            self._defer(job, min(30.0, 0.5 * 2 ** job.attempt))
+        else:
+            self._finish(job, result=msg)
+
+    async def broadcast(self, text: str, pages) -> Report:
+        # pages: async iterator of chat_id lists; the bounded queue keeps memory flat
+        report = Report()
+        pending = set()
+        async for chat_ids in pages:
+            for chat_id in chat_ids:
+                fut = await self.send(chat_id, text, report)
+                pending.add(fut)
+                fut.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+        return report
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import PERSISTENCE_FLUSH_SEC
+from db import get_db, transaction, run_db
+
+log = logging.getLogger("persistence")
+
+# PTB persistence in the bot's SQLite file (table ptb_data, one pickled row per user /
+# chat / bot_data / conversation).
+#
+# - user_data / chat_data load lazily: the Application starts with nothing and
+#   refresh_*_data() fills a user's dict from SQLite the first time one of their updates
+#   (or jobs) is processed.
+# - PTB hands us every user / chat it touched since the last run (every PERSISTENCE_FLUSH_SEC);
+#   only those whose pickled bytes differ from what SQLite holds are written, all in one
+#   transaction. Empty dicts delete their row.
+
+
+def _load(kind: str, key: str):
+    with get_db() as db:
+        r = db.execute("SELECT data FROM ptb_data WHERE kind=? AND key=?", (kind, key)).fetchone()
+        return pickle.loads(r["data"]) if r else None
+
+
+def _load_kind(kind: str) -> dict:
+    with get_db() as db:
+        return {r["key"]: pickle.loads(r["data"]) for r in db.execute("SELECT key, data FROM ptb_data WHERE kind=?", (kind,))}
+
+
+def _write(rows: list, deletes: list):
+    with transaction() as db:
+        if rows:
+            db.executemany(
+                "INSERT INTO ptb_data(kind, key, data) VALUES (?,?,?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET data=excluded.data",
+                rows,
+            )
+        if deletes:
+            db.executemany("DELETE FROM ptb_data WHERE kind=? AND key=?", deletes)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_SEC):
+        super().__init__(
+            store_data=PersistenceInput(user_data=True, chat_data=True, bot_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded = {"user": set(), "chat": set()}
+        self._saved = {}    # (kind, key) -> hash of the pickled bytes in SQLite
+        self._pending = {}  # (kind, key) -> pickled bytes, or None to delete
+        self._flush_task = None
+
+    # ---- dirty tracking ----
+    def _mark(self, kind: str, key, data):
+        key = str(key)
+        empty = data is None or (isinstance(data, dict) and not data)
+        blob = None if empty else pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        h = hash(blob) if blob is not None else None
+        if self._saved.get((kind, key)) == h and (kind, key) not in self._pending:
+            return
+        self._pending[(kind, key)] = blob
+        if self._flush_task is None:
+            # PTB updates all touched keys in one gather(); write them together right after
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        try:
+            await asyncio.sleep(0)
+            await self.flush()
+        except Exception:
+            log.exception("persistence: flush failed, will retry on the next run")
+        finally:
+            self._flush_task = None
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [(kind, key, blob) for (kind, key), blob in batch.items() if blob is not None]
+        deletes = [(kind, key) for (kind, key), blob in batch.items() if blob is None]
+        try:
+            await run_db(_write, rows, deletes)
+        except Exception:
+            for k, blob in batch.items():
+                self._pending.setdefault(k, blob)
+            raise
+        for (kind, key), blob in batch.items():
+            self._saved[(kind, key)] = hash(blob) if blob is not None else None
+
+    # ---- lazy loading ----
+    async def _refresh(self, kind: str, ident: int, data: dict):
+        loaded = self._loaded[kind]
+        if ident in loaded:
+            return
+        stored = await run_db(_load, kind, str(ident))
+        loaded.add(ident)
+        if stored:
+            # keep what handlers may already have put there
+            for k, v in stored.items():
+                data.setdefault(k, v)
+            self._saved[(kind, str(ident))] = hash(pickle.dumps(stored, protocol=pickle.HIGHEST_PROTOCOL))
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        await self._refresh("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        await self._refresh("chat", chat_id, chat_data)
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        self._mark("user", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        self._mark("chat", chat_id, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark("chat", chat_id, None)
+
+    # ---- bot_data: one row, loaded at startup ----
+    async def get_bot_data(self):
+        data = await run_db(_load, "bot", "0") or {}
+        if data:
+            self._saved[("bot", "0")] = hash(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        return data
+
+    async def update_bot_data(self, data) -> None:
+        self._mark("bot", 0, data)
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    # ---- ConversationHandler state (none in use yet; kept complete for PTB) ----
+    async def get_conversations(self, name: str):
+        rows = await run_db(_load_kind, "conv")
+        prefix = f"{name}:"
+        return {tuple(json.loads(k[len(prefix):])): v for k, v in rows.items() if k.startswith(prefix)}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._mark("conv", f"{name}:{json.dumps(list(key))}", new_state)
+
+    # ---- arbitrary callback data is not used ----
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
@@ -1,42 +1,72 @@
-from db import get_db, add_tickets, add_donation
+import threading
+import time
+from db import get_db, transaction, write_credits, invalidate_user, TICKETS
+
+# Active tasks are served from memory for display; add_ref_task / deactivate_task drop the
+# copy, and it expires after CATALOG_TTL so other processes (cluster workers) catch up.
+# complete_task() checks the task in SQLite, never here.
+# The catalog is a tuple of dicts shared between callers: read it, don't mutate it.
+CATALOG_TTL = 60
+_catalog = None
+_catalog_at = 0.0
+_catalog_lock = threading.Lock()
+
+def _invalidate_catalog():
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
 
 def add_ref_task(title: str, link: str, reward: int = 1):
-    with get_db() as db:
+    with transaction() as db:
         db.execute(
             "INSERT INTO referral_tasks(title, link, reward_stars) VALUES (?,?,?)",
             (title, link, reward)
         )
+    _invalidate_catalog()
 
-def get_active_tasks():
-    with get_db() as db:
-        rows = db.execute(
-            "SELECT * FROM referral_tasks WHERE active=1"
-        ).fetchall()
-        return [dict(r) for r in rows]
+def deactivate_task(task_id: int) -> bool:
+    with transaction() as db:
+        n = db.execute("UPDATE referral_tasks SET active=0 WHERE id=? AND active=1", (task_id,)).rowcount
+    _invalidate_catalog()
+    return n > 0
 
-def complete_task(user_id: int, task_id: int):
-    with get_db() as db:
-        r = db.execute(
-            "SELECT completed FROM referral_task_logs WHERE user_id=? AND task_id=?",
-            (user_id, task_id)
-        ).fetchone()
-        if r:
-            return False
+def get_active_tasks():
+    global _catalog, _catalog_at
+    with _catalog_lock:
+        if _catalog is None or time.monotonic() - _catalog_at > CATALOG_TTL:
+            with get_db() as db:
+                rows = db.execute(
+                    "SELECT * FROM referral_tasks WHERE active=1 ORDER BY id"
+                ).fetchall()
+            _catalog = tuple(dict(r) for r in rows)
+            _catalog_at = time.monotonic()
+        return _catalog
 
-        task = db.execute(
-            "SELECT reward_stars FROM referral_tasks WHERE id=?",
-            (task_id,)
-        ).fetchone()
+def get_task(task_id: int):
+    return next((t for t in get_active_tasks() if t["id"] == task_id), None)
 
+def complete_task(user_id: int, task_id: int):
+    # returns the reward, or 0 if the task is inactive / already done
+    with transaction() as db:
+        # active flag and reward come from SQLite under the write lock: another process's
+        # catalog may still list a task that was just deactivated
+        task = db.execute("SELECT reward_stars FROM referral_tasks WHERE id=? AND active=1", (task_id,)).fetchone()
         if not task:
-            return False
-
-        db.execute(
-            "INSERT INTO referral_task_logs(user_id, task_id, completed) VALUES (?,?,1)",
+            return 0
+        # the log's primary key decides who gets credited: a double tap inserts once
+        done = db.execute(
+            "INSERT OR IGNORE INTO referral_task_logs(user_id, task_id, completed) VALUES (?,?,1)",
             (user_id, task_id)
-        )
+        ).rowcount
+        if not done:
+            return 0
+
+        # 1 ⭐ = 1 білет (можеш міняти)
+        reward = task["reward_stars"]
+        write_credits(db, [
+            (user_id, reward, TICKETS, "ref_task"),
+            (user_id, reward, "XTR", "ref_task"),
+        ])
 
-    # 1 ⭐ = 1 білет (можеш міняти)
-    add_tickets(user_id, task["reward_stars"])
-    add_donation(user_id, task["reward_stars"], "XTR")
-    return True
+    invalidate_user(user_id)
+    return reward
@@ -0,0 +1,48 @@
+import time
+from db import get_db, utc_day
+
+# Admin /stats, answered from the rollup tables (donation_daily, donation_month,
+# ticket_daily): a bounded number of rows per window, independent of the donations count.
+WINDOWS = (("today", 1), ("7d", 7), ("30d", 30))
+
+def _since(days: int) -> str:
+    return utc_day(int(time.time()) - (days - 1) * 86400)
+
+def revenue(days: int):
+    with get_db() as db:
+        rows = db.execute(
+            "SELECT currency, SUM(amount) AS amount, SUM(n) AS n FROM donation_daily WHERE day>=? GROUP BY currency",
+            (_since(days),),
+        ).fetchall()
+        return {r["currency"]: (r["amount"], r["n"]) for r in rows}
+
+def donors(month: str | None = None) -> int:
+    month = month or utc_day(int(time.time()))[:7]
+    with get_db() as db:
+        r = db.execute("SELECT donors FROM donation_month WHERE month=?", (month,)).fetchone()
+        return r["donors"] if r else 0
+
+def tickets(days: int):
+    with get_db() as db:
+        rows = db.execute(
+            "SELECT reason, SUM(issued) AS issued, SUM(spent) AS spent FROM ticket_daily WHERE day>=? GROUP BY reason",
+            (_since(days),),
+        ).fetchall()
+        return {r["reason"]: (r["issued"], r["spent"]) for r in rows}
+
+def stats_text() -> str:
+    lines = ["📊 stats (UTC days)", "", "💰 revenue"]
+    for label, days in WINDOWS:
+        rev = revenue(days)
+        parts = ", ".join(f"{a:g} {cur} ({n})" for cur, (a, n) in sorted(rev.items())) or "—"
+        lines.append(f"{label}: {parts}")
+
+    month = utc_day(int(time.time()))[:7]
+    lines += ["", f"👥 donors {month}: {donors(month)}", "", "🎟 tickets issued / spent"]
+    for label, days in WINDOWS:
+        tix = tickets(days)
+        issued = sum(i for i, _ in tix.values())
+        spent = sum(s for _, s in tix.values())
+        by_reason = ", ".join(f"{r} {i}" for r, (i, _) in sorted(tix.items()) if i)
+        lines.append(f"{label}: +{issued} / -{spent}" + (f" ({by_reason})" if by_reason else ""))
+    return "\n".join(lines)
@@ -1,25 +1,90 @@
+import heapq
+import threading
 import time
 from config import VIP_MULTIPLIER, VIP_DAYS_DEFAULT, VIP_TICKETS_BONUS
-from db import get_user, get_db, add_tickets
+from db import get_user_cached, get_db, transaction, add_tickets, invalidate_user
 
-def is_vip(user_id: int) -> bool:
-    u = get_user(user_id)
-    if not u:
-        return False
-    return int(u.get("vip_until", 0)) > int(time.time())
+# VIP state in memory: user_id -> vip_until for current VIPs (and expired ones not swept
+# yet), plus a min-heap of (vip_until, user_id) so the sweep only touches what is due.
+# Heap entries whose vip_until no longer matches the map are stale and skipped.
+# Loaded once from the idx_users_vip_pending partial index; activate_vip() keeps it current.
+_lock = threading.Lock()
+_until = {}
+_heap = []
+_loaded = False
 
-def vip_until_ts(user_id: int) -> int:
-    u = get_user(user_id)
+def load():
+    global _loaded
+    with get_db() as db:
+        rows = db.execute("SELECT user_id, vip_until FROM users WHERE vip_until > vip_notified").fetchall()
+    with _lock:
+        _until.clear()
+        _until.update((int(r["user_id"]), int(r["vip_until"])) for r in rows)
+        _heap[:] = [(until, uid) for uid, until in _until.items()]
+        heapq.heapify(_heap)
+        _loaded = True
+
+def _set(user_id: int, until: int):
+    # under _lock
+    _until[user_id] = until
+    heapq.heappush(_heap, (until, user_id))
+
+# `user` is an already loaded users row (snapshot); a later vip_until in it (activated by
+# another process) is taken over.
+def is_vip(user_id: int, user: dict | None = None) -> bool:
+    if not _loaded:
+        load()
+    now = time.time()
+    until = _until.get(user_id, 0)
+    if user is not None:
+        row_until = int(user.get("vip_until", 0) or 0)
+        # only a still-running VIP: an expired one would re-enter after every sweep
+        if row_until > until and row_until > now:
+            with _lock:
+                _set(user_id, row_until)
+            until = row_until
+    return until > now
+
+def vip_until_ts(user_id: int, user: dict | None = None) -> int:
+    u = get_user_cached(user_id) if user is None else user
     return int(u.get("vip_until", 0)) if u else 0
 
 def activate_vip(user_id: int, days: int = VIP_DAYS_DEFAULT):
     now = int(time.time())
     until = now + days * 86400
-    with get_db() as db:
+    with transaction() as db:
         db.execute("UPDATE users SET vip_until=? WHERE user_id=?", (until, user_id))
-    add_tickets(user_id, VIP_TICKETS_BONUS)
+    invalidate_user(user_id)
+    if _loaded:
+        with _lock:
+            _set(user_id, until)
+    add_tickets(user_id, VIP_TICKETS_BONUS, "vip")
+
+def apply_vip_multiplier(user_id: int, base: int, user: dict | None = None) -> int:
+    return int(base * VIP_MULTIPLIER) if is_vip(user_id, user) else base
 
-def apply_vip_multiplier(user_id: int, base: int) -> int:
-    return int(base * VIP_MULTIPLIER) if is_vip(user_id) else base
+def expire_due(now: int | None = None) -> list:
+    # -> [(user_id, lang)] whose VIP ran out since the last sweep, each returned once.
+    # SQLite decides (VIPs activated by other processes expire too); the heap drops the
+    # local entries.
+    now = int(now or time.time())
+    with transaction() as db:
+        rows = db.execute(
+            "SELECT user_id, vip_until, lang FROM users WHERE vip_until > vip_notified AND vip_until <= ?",
+            (now,),
+        ).fetchall()
+        if rows:
+            db.executemany(
+                "UPDATE users SET vip_notified=? WHERE user_id=?",
+                [(r["vip_until"], r["user_id"]) for r in rows],
+            )
+    with _lock:
+        while _heap and _heap[0][0] <= now:
+            until, uid = heapq.heappop(_heap)
+            if _until.get(uid) == until:
+                del _until[uid]
+    return [(int(r["user_id"]), r["lang"] or "ua") for r in rows]
 
-    
+def stats() -> dict:
+    with _lock:
+        return {"tracked": len(_until), "heap": len(_heap)}
@@ -0,0 +1,204 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_SIZE,
+)
+
+log = logging.getLogger("webhook")
+
+MAX_BODY = 1024 * 1024
+MAX_HEADERS = 100
+IDLE_TIMEOUT = 60.0   # keep-alive connection waiting for its next request
+READ_TIMEOUT = 10.0   # headers + body of a request once its first line arrived
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 431: "Request Header Fields Too Large", 503: "Service Unavailable"}
+
+
+# Minimal HTTP/1.1 listener for Telegram webhooks (no extra dependencies).
+# A request is answered as soon as its body is in the bounded ingest queue; parsing and
+# handling happen in the consumer task. A full queue answers 503, and Telegram redelivers.
+class WebhookServer:
+    def __init__(self, application, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET, queue_size: int = WEBHOOK_QUEUE_SIZE, sink=None):
+        # sink: async fn(update dict) used instead of the application (cluster ingest)
+        self.app = application
+        self.sink = sink
+        self.path = path
+        self.secret = secret
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.accepted = 0
+        self.rejected = 0
+        self._server = None
+        self._consumer = None
+        self._conns = set()
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        # a public URL without a secret lets anyone POST updates (and pose as an admin)
+        if WEBHOOK_URL and not self.secret:
+            raise RuntimeError("WEBHOOK_SECRET missing: required when WEBHOOK_URL is set")
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self._consumer = asyncio.create_task(self._consume())
+        log.info("webhook listening on %s:%s%s", host, port, self.path)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # idle keep-alive connections would otherwise outlive the server
+            for w in list(self._conns):
+                w.close()
+            await self._server.wait_closed()
+            await asyncio.sleep(0)
+        if self._consumer:
+            # hand over what was already acknowledged to Telegram
+            await self.queue.join()
+            self._consumer.cancel()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._conns.add(writer)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                    if not line:
+                        break
+                    # the rest of the request has READ_TIMEOUT to arrive (no slow-loris)
+                    req = await asyncio.wait_for(self._read_request(reader, line), READ_TIMEOUT)
+                except (asyncio.LimitOverrunError, ValueError):  # request line over the StreamReader limit
+                    req = 400
+                except asyncio.TimeoutError:
+                    break
+                if isinstance(req, int):
+                    await self._respond(writer, req, close=True)
+                    break
+                method, target, headers, body = req
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                status = self._route(method, target.split("?", 1)[0], headers, body)
+                await self._respond(writer, status, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._conns.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader, line: bytes):
+        # -> (method, target, headers, body), or an error status to answer before closing
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400
+
+        headers = {}
+        while True:
+            try:
+                h = await reader.readline()
+            except (asyncio.LimitOverrunError, ValueError):  # header line over the StreamReader limit
+                return 431
+            if h in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                return 431
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+
+        length = headers.get("content-length", "0") or "0"
+        if not (length.isascii() and length.isdigit()):
+            return 400
+        length = int(length)
+        if length > MAX_BODY:
+            return 413
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    def _route(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        if path != self.path:
+            return 200 if (method == "GET" and path == "/") else 404  # "/" = health check
+        if method != "POST":
+            return 405
+        if self.secret and not hmac.compare_digest(
+            headers.get("x-telegram-bot-api-secret-token", "").encode("latin-1"), self.secret.encode()
+        ):
+            self.rejected += 1
+            return 403
+        try:
+            self.queue.put_nowait(body)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503
+        self.accepted += 1
+        return 200
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, close: bool = False):
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+    async def _consume(self):
+        while True:
+            body = await self.queue.get()
+            try:
+                data = json.loads(body)
+                if self.sink:
+                    await self.sink(data)
+                else:
+                    await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+            except Exception:
+                log.exception("webhook: bad update payload")
+            finally:
+                self.queue.task_done()
+
+
+async def _serve(app):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+
+    server = WebhookServer(app)
+    await server.start()
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        log.info("WEBHOOK_URL empty: not registering with Telegram (local mode)")
+
+    await app.start()
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_webhook(app):
+    # webhook counterpart of app.run_polling()
+    asyncio.run(_serve(app))
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# config.py reads the environment at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bot_tests_"), "test.sqlite3"))
+
+import db  # noqa: E402
+
+db.init_db()
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ExtBot, TypeHandler
+
+from modules import flood
+from modules.persistence import SQLitePersistence
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "test", "username": "test_bot"}
+
+
+class FakeBot(ExtBot):
+    async def _do_post(self, endpoint, data, **kwargs):
+        return BOT_USER if endpoint == "getMe" else True
+
+
+def message(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def test_dropped_updates_skip_the_persistence_load(monkeypatch):
+    # one command token per user: every user's second /start is dropped
+    monkeypatch.setattr(flood, "limiter", flood.Limiter(flood.parse_limits("command=0.001:1"), {}))
+    refreshed, handled = [], []
+
+    class CountingPersistence(SQLitePersistence):
+        async def refresh_user_data(self, user_id, user_data):
+            refreshed.append(user_id)
+
+    async def on_update(update, context):
+        handled.append(update.effective_user.id)
+
+    async def run():
+        app = ApplicationBuilder().bot(FakeBot("1:test")).updater(None).persistence(CountingPersistence()).build()
+        app.add_handler(flood.FloodGuard(), group=-1)
+        app.add_handler(TypeHandler(Update, on_update))
+        await app.initialize()
+        for i, uid in enumerate([10, 10, 11, 11, 11], start=1):
+            await app.process_update(Update.de_json(message(i, uid, "/start"), app.bot))
+        await app.shutdown()
+
+    asyncio.run(run())
+    assert handled == [10, 11]
+    assert refreshed == [10, 11]
+    assert flood.limiter.dropped["command"] == 3
@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+import main
+from modules import ads
+
+
+def order(i: int, text: str, link: str) -> dict:
+    return {"id": i, "user_id": 100 + i, "price": 50, "currency": "XTR", "created_at": 0, "text": text, "link": link}
+
+
+def utf16_len(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+
+@pytest.mark.parametrize("n", [1, 5, 20])
+def test_page_fits_one_message(n):
+    orders = [order(i, "😀" * 1000, "https://example.com/" + "x" * 5000) for i in range(1, n + 1)]
+    text, kb = main.moderation_view(orders, 0, True)
+    assert utf16_len(text) <= 4096
+    for i in range(1, n + 1):
+        assert f"#{i} ·" in text
+
+
+def test_clip():
+    assert main.clip("abc", 3) == "abc"
+    assert main.clip("abcdef", 4) == "abc…"
+    assert utf16_len(main.clip("😀" * 10, 5)) <= 5
+
+
+def test_review_rejects_unknown_status():
+    with pytest.raises(ValueError):
+        ads.review([1], "deleted")
+
+
+def run_callback(monkeypatch, error: str):
+    async def edit_message_text(text, **kwargs):
+        raise BadRequest(error)
+
+    async def answer(*args, **kwargs):
+        pass
+
+    async def review_page(after, limit):
+        return [], False
+
+    monkeypatch.setattr(main, "is_admin", lambda uid: True)
+    monkeypatch.setattr(main.adb, "review_page", review_page)
+    q = SimpleNamespace(from_user=SimpleNamespace(id=1), data="mod:p:0", answer=answer, edit_message_text=edit_message_text)
+    asyncio.run(main.cb_moderate(SimpleNamespace(callback_query=q), SimpleNamespace(user_data={})))
+
+
+def test_callback_ignores_not_modified(monkeypatch):
+    run_callback(monkeypatch, "Message is not modified: specified new message content is the same")
+
+
+def test_callback_surfaces_other_bad_requests(monkeypatch):
+    with pytest.raises(BadRequest):
+        run_callback(monkeypatch, "Message is too long")
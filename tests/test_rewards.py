@@ -0,0 +1,25 @@
+import db
+from modules import leaderboard, lottery
+
+
+def test_rewards_follow_sql_not_a_stale_board():
+    with db.get_db() as conn:
+        conn.execute("UPDATE users SET tickets=0")
+        conn.executemany(
+            "INSERT OR REPLACE INTO users(user_id, username, first_name, tickets, created_at) VALUES (?,?,?,?,0)",
+            [(7000 + i, f"u{i}", "Test", 10 * i) for i in range(1, 21)],
+        )
+    leaderboard.rebuild()
+    # another process raises a user to the top; this process's board never hears of it
+    with db.get_db() as conn:
+        conn.execute("UPDATE users SET tickets=100000 WHERE user_id=7001")
+        conn.execute("DELETE FROM donations WHERE reason='lottery_reward'")
+    assert leaderboard.top_tickets(1)[0]["user_id"] == 7020
+
+    assert lottery.distribute_rewards() == 20
+    with db.get_db() as conn:
+        paid = dict(conn.execute("SELECT user_id, amount FROM donations WHERE reason='lottery_reward'").fetchall())
+    # 7001 first; 7016 drops to 6th place (it would be 5th on the stale board)
+    assert paid[7001] == 300
+    assert paid[7017] == 300
+    assert paid[7016] == 100
@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import db
+import main
+
+
+def run_start(user_id: int, args: list) -> list:
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, username=f"u{user_id}", first_name="Test"),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+    context = SimpleNamespace(args=args)
+    asyncio.run(main.cmd_start(update, context))
+    db.close_pool()
+    return replies
+
+
+def stored_user(user_id: int):
+    with db.get_db() as conn:
+        return conn.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
+
+
+@pytest.mark.parametrize("arg", ["99999999999999999999", str(2**63), "²", "１２", "0", "-5", "12a"])
+def test_parse_ref_id_rejects(arg):
+    assert main.parse_ref_id(arg) is None
+
+
+def test_parse_ref_id_accepts():
+    assert main.parse_ref_id("12345") == 12345
+    assert main.parse_ref_id(str(2**63 - 1)) == 2**63 - 1
+
+
+@pytest.mark.parametrize("user_id, payload", [(9001, "99999999999999999999"), (9002, "²")])
+def test_start_with_bad_payload_still_signs_up(user_id, payload):
+    replies = run_start(user_id, [payload])
+    assert len(replies) == 1
+    assert stored_user(user_id) is not None
+    with db.get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM refs WHERE user_id=?", (user_id,)).fetchone()[0] == 0
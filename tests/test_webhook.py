@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from modules.webhook import WebhookServer
+
+
+async def exchange(raw: bytes, **server_kwargs) -> bytes:
+    received = []
+
+    async def sink(data):
+        received.append(data)
+
+    server = WebhookServer(None, path="/hook", secret="s3cret", sink=sink, **server_kwargs)
+    await server.start("127.0.0.1", 0)
+    port = server._server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        await writer.drain()
+        resp = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+    finally:
+        await server.stop()
+    return resp
+
+
+def status(resp: bytes) -> int:
+    return int(resp.split(b" ", 2)[1])
+
+
+def test_post_is_accepted():
+    body = b'{"update_id": 1}'
+    raw = (
+        b"POST /hook HTTP/1.1\r\nX-Telegram-Bot-Api-Secret-Token: s3cret\r\nConnection: close\r\n"
+        b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+    )
+    assert status(asyncio.run(exchange(raw))) == 200
+
+
+def test_oversized_request_line():
+    raw = b"POST /hook?" + b"a" * 200_000 + b" HTTP/1.1\r\n\r\n"
+    assert status(asyncio.run(exchange(raw))) == 400
+
+
+@pytest.mark.parametrize("headers", [
+    b"X-Big: " + b"a" * 200_000 + b"\r\n",
+    b"".join(b"X-H%d: 1\r\n" % i for i in range(200)),
+], ids=["long-line", "too-many"])
+def test_oversized_headers(headers):
+    raw = b"POST /hook HTTP/1.1\r\n" + headers + b"\r\n"
+    assert status(asyncio.run(exchange(raw))) == 431